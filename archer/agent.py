@@ -0,0 +1,282 @@
+'''
+    Worker agent. Accepts job specs from controllers over TCP, runs the
+    jobs in this process and streams their output and events back.
+    Controllers connect to agents with Controller.addAgent("host:port").
+
+    Usage: ARCHER_AGENT_TOKEN=<secret> python -m archer.agent
+               [--bind host:port] [--capacity N]
+
+    Controllers have to present the shared token set in ARCHER_AGENT_TOKEN.
+    Without a token, agent only listens on loopback addresses: anyone
+    who can reach the port can run jobs (network scans) through it.
+
+    Protocol: newline-delimited JSON messages. On connect, agent sends
+    {"op": "hello", "capacity": N}. Controller answers {"op": "auth",
+    "token": T}; agent replies "ready", or "denied" and disconnects.
+    Then controller sends "run" (task, name, context), "write" (task, data)
+    and "signal" (task, sig). Agent sends "output" (task, data), "events"
+    (task, events), "exit" (task, code, state) and, every HEARTBEAT
+    seconds, "load" (running, load).
+'''
+
+import argparse
+import hmac
+import ipaddress
+import os
+import selectors
+import socket
+import time
+
+from .core.remote import Channel
+
+
+class Agent:
+    '''
+        Worker agent server. Serves any number of controller connections.
+        Jobs of a connection that is closed are killed.
+    '''
+
+
+    # General case error
+    class Error(Exception): pass
+
+    # Exception that is raised by constructor if agent would listen
+    # on non-loopback address without a token
+    class TokenError(Error): pass
+
+
+    HEARTBEAT = 1.0 # seconds between load reports
+
+
+    def __init__(self, address=("127.0.0.1", 0), capacity=None, factory=None,
+                 token=None):
+        '''
+            Start listening on given (host, port) address.
+            Capacity is the number of jobs agent runs at full speed,
+            number of cpus by default. Factory creates jobs from name
+            and context, Job by default. Token is the secret that
+            controllers have to present.
+            Raise self.TokenError if token is not given and address
+            is not a loopback one.
+        '''
+        if not token and not _isLoopback(address[0]):
+            raise self.TokenError("token is required to listen on {}".format(address[0]))
+        if factory is None:
+            from .core.job import Job
+            factory = Job
+
+        self.capacity = capacity or os.cpu_count() or 1
+        self._factory = factory
+        self._token = token # shared secret, None if not required
+        self._server = socket.create_server(address)
+        self._server.setblocking(False)
+        self.address = self._server.getsockname()[:2] # actual (host, port)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ, None)
+        self._clients = {} # keys are Channel objects, values - {task: job}
+        self._trusted = set() # channels that presented the token
+        self._heartbeat = 0.0 # time of the last load report
+        self._stopped = False
+
+
+    def serve(self, period=0.05):
+        '''
+            Serve until stop() is called.
+            Period is the time between job updates, in seconds.
+        '''
+        while not self._stopped:
+            self.step(period)
+        self._close()
+
+
+    def stop(self):
+        '''
+            Make serve() return.
+        '''
+        self._stopped = True
+
+
+    def step(self, timeout=0.0):
+        '''
+            Do one round of work: accept connections, handle messages,
+            update jobs and send their output.
+        '''
+        for key, _ in self._selector.select(timeout):
+            if key.data is None:
+                self._accept()
+            else:
+                for msg in key.data.receive():
+                    self._handle(key.data, msg)
+
+        running = 0
+        for channel, jobs in list(self._clients.items()):
+            if channel.closed:
+                self._drop(channel)
+                continue
+            for task, job in list(jobs.items()):
+                self._pump(channel, task, job)
+            running += len(jobs)
+            channel.flush()
+
+        now = time.time()
+        if now - self._heartbeat >= self.HEARTBEAT:
+            self._heartbeat = now
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            for channel in self._trusted:
+                channel.send({"op": "load", "running": running, "load": load})
+
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except OSError:
+            return
+        channel = Channel(sock)
+        self._clients[channel] = {}
+        self._selector.register(sock, selectors.EVENT_READ, channel)
+        channel.send({"op": "hello", "capacity": self.capacity})
+
+
+    def _handle(self, channel, msg):
+        '''
+            Handle message received from controller.
+        '''
+        jobs = self._clients.get(channel)
+        if jobs is None:
+            return
+        op, task = msg.get("op"), msg.get("task")
+
+        # Nothing but a valid token is accepted from a new connection
+        if channel not in self._trusted:
+            if op == "auth" and self._authorized(msg.get("token")):
+                self._trusted.add(channel)
+                channel.send({"op": "ready"})
+            else:
+                channel.send({"op": "denied"})
+                channel.close()
+            return
+
+        if op == "run":
+            try:
+                job = self._factory(msg.get("name"), self._context(msg.get("context") or {}))
+                job.run()
+            except Exception as exc:
+                channel.send({"op": "output", "task": task, "data": str(exc) + "\n"})
+                channel.send({"op": "exit", "task": task, "code": None, "state": "failed"})
+                return
+            jobs[task] = job
+
+        elif task in jobs:
+            try:
+                if op == "write":
+                    jobs[task].write(msg.get("data") or "")
+                elif op == "signal":
+                    jobs[task].signal(msg.get("sig") or "term")
+            except Exception as exc:
+                channel.send({"op": "output", "task": task, "data": str(exc) + "\n"})
+
+
+    def _pump(self, channel, task, job):
+        '''
+            Update job and send its events and output to controller.
+        '''
+        events = job.update() or []
+        if events:
+            channel.send({"op": "events", "task": task, "events": events})
+        data = job.read()
+        if data:
+            channel.send({"op": "output", "task": task, "data": data})
+        if not job.isRunning():
+            del self._clients[channel][task]
+            channel.send({"op": "exit", "task": task, "code": job.return_code,
+                          "state": job.state})
+
+
+    def _authorized(self, token):
+        '''
+            Return True if token presented by controller is valid.
+        '''
+        if not self._token:
+            return True
+        return isinstance(token, str) and \
+            hmac.compare_digest(token.encode(), self._token.encode())
+
+
+    def _context(self, spec):
+        '''
+            Build job context from spec sent by controller.
+            Objects are detached: they do not belong to any LocalHost.
+        '''
+        from .core.interface import Interface
+        from .core.host import Host
+        from .core.port import Port
+
+        context = {"interface": None, "host": None, "port": None}
+        if spec.get("interface"):
+            context["interface"] = Interface(spec["interface"])
+        if spec.get("host"):
+            context["host"] = Host(spec["host"])
+        if spec.get("port"):
+            context["port"] = Port(int(spec["port"]), spec.get("proto"))
+        return context
+
+
+    def _drop(self, channel):
+        '''
+            Forget closed connection and kill its jobs.
+        '''
+        self._trusted.discard(channel)
+        for job in self._clients.pop(channel).values():
+            try:
+                job.signal("kill")
+            except Exception:
+                pass
+        try:
+            self._selector.unregister(channel.sock)
+        except (KeyError, ValueError):
+            pass
+
+
+    def _close(self):
+        for channel in list(self._clients):
+            channel.close()
+            self._drop(channel)
+        self._selector.close()
+        self._server.close()
+
+
+def _isLoopback(host):
+    '''
+        Return True if host is a loopback address or "localhost".
+    '''
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="archer worker agent")
+    parser.add_argument("--bind", default="127.0.0.1:7735",
+                        help="address to listen on, host:port")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="number of jobs to run at full speed")
+    args = parser.parse_args()
+
+    host, _, port = args.bind.rpartition(":")
+    try:
+        agent = Agent((host, int(port)), args.capacity,
+                      token=os.environ.get("ARCHER_AGENT_TOKEN"))
+    except Agent.TokenError as exc:
+        parser.error("{}; set ARCHER_AGENT_TOKEN".format(str(exc)))
+    print("archer agent listening on {}:{}".format(*agent.address), flush=True)
+    try:
+        agent.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+'''
+    Bulk export and import of the inventory (interfaces, hosts, ports)
+    in columnar formats. Every host and every port is one row; rows are
+    built and written chunk by chunk, walking interfaces one at a time,
+    so that besides the current chunk only references to the hosts of
+    one interface are held. The exception is "npy", whose row count
+    is needed up front: it lists all the hosts before writing. Columns:
+
+        kind - 0 for host, 1 for port
+        iface - interface name
+        ip - host ip address as integer
+        mac, os - host mac address and operating system ("" if unknown)
+        proto - 0 for hosts, 1 for tcp, 2 for udp
+        number - port number, 0 for hosts
+        state - state code, index in STATES (states not listed there
+            are exported as "unknown")
+        last_activity - timestamp, NaN (null) if unknown
+
+    Import merges the file chunk by chunk. Every chunk is validated
+    before it is merged, but if a later chunk turns out malformed,
+    the chunks before it stay imported (see PartialError).
+
+    Supported formats: "npy" (NumPy structured array, requires numpy;
+    widths of text columns are extended to fit the longest value),
+    "csv", "jsonl" (one JSON object of column arrays per chunk),
+    "parquet" and "arrow" (require pyarrow).
+'''
+
+import csv
+import json
+import math
+
+from . import util
+from .core.host import Host
+from .core.port import Port
+
+
+# General case error. Error string is human-readable.
+class Error(Exception): pass
+
+
+# Exception raised by import_ if file is malformed. Chunks read before
+# the malformed one have been merged already; their numbers of hosts,
+# ports and skipped rows are in counts attribute.
+class PartialError(Error):
+    def __init__(self, message, counts):
+        super().__init__(message)
+        self.counts = counts # dict like the one import_ returns
+
+
+# Column names and NumPy types
+COLUMNS = [
+    ("kind", "u1"),
+    ("iface", "U16"),
+    ("ip", "u4"),
+    ("mac", "U17"),
+    ("os", "U64"),
+    ("proto", "u1"),
+    ("number", "u2"),
+    ("state", "u1"),
+    ("last_activity", "f8"),
+]
+
+# Codes of host and port states
+STATES = ("unknown", "up", "down", "stale", "open", "closed", "filtered",
+          "unfiltered", "open|filtered", "closed|filtered")
+
+# Codes of transport protocols
+PROTOS = ("", "tcp", "udp")
+
+# Format names by file extension
+EXTENSIONS = {
+    ".npy": "npy",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+}
+
+# Number of rows in a chunk
+CHUNK = 65536
+
+
+_state_codes = {state: code for code, state in enumerate(STATES)}
+_names = [name for name, _ in COLUMNS]
+
+
+def guessFormat(path):
+    '''
+        Return format name by file extension, None if it is unknown.
+    '''
+    for ext, fmt in EXTENSIONS.items():
+        if path.lower().endswith(ext):
+            return fmt
+    return None
+
+
+def export(localhost, path, fmt, chunk=CHUNK):
+    '''
+        Write inventory of given LocalHost to file in given format.
+        Return number of rows written.
+        Raise Error if format is unknown or its library is not installed.
+    '''
+    writer = _writers.get(fmt)
+    if writer is None:
+        raise Error("unknown format: {}".format(fmt))
+
+    return writer(path, _hosts(localhost), chunk)
+
+
+def import_(localhost, path, fmt, chunk=CHUNK):
+    '''
+        Read inventory from file in given format and merge it into
+        given LocalHost. Hosts and ports are built in bulk and added
+        to LocalHost chunk by chunk. Rows of unknown interfaces are skipped.
+        Return dict with numbers of imported hosts, ports and skipped rows.
+        Raise Error if format is unknown or its library is not installed.
+        Raise PartialError if file is malformed; chunks before
+        the malformed one are imported.
+    '''
+    reader = _readers.get(fmt)
+    if reader is None:
+        raise Error("unknown format: {}".format(fmt))
+
+    counts = {"hosts": 0, "ports": 0, "skipped": 0}
+    try:
+        for columns in reader(path, chunk):
+            _load(localhost, columns, counts)
+    except (KeyError, IndexError, TypeError, ValueError,
+            Host.Error, Port.Error) as exc:
+        message = "malformed file: {}".format(str(exc) or type(exc).__name__)
+        if counts["hosts"] or counts["ports"]:
+            message += " ({hosts} hosts and {ports} ports before it were imported)" \
+                .format(**counts)
+        raise PartialError(message, counts)
+    return counts
+
+
+def _hosts(localhost):
+    '''
+        Return generator of (iface name, host, ports) tuples of all
+        the hosts of LocalHost. Ports of every host are listed at once.
+    '''
+    for iface in list(localhost.interfaces.values()):
+        for host in list(iface.hosts.values()):
+            yield iface.name, host, host.allPorts()
+
+
+def _rows(hosts):
+    '''
+        Return generator of row tuples for given (iface name, host, ports).
+    '''
+    for name, host, ports in hosts:
+        ip = util.ip_to_int(host.ip)
+        yield (0, name, ip, host.mac or "", host.os or "", 0, 0,
+               _state_codes.get(host.state, 0), _timestamp(host.last_activity))
+        for port in ports:
+            yield (1, name, ip, "", "", PROTOS.index(port.proto), port.number,
+                   _state_codes.get(port.state, 0),
+                   _timestamp(port.last_activity))
+
+
+def _chunks(hosts, chunk):
+    '''
+        Return generator of chunks. Chunk is a dict whose keys are
+        column names and values are lists of column values.
+    '''
+    batch = []
+    for row in _rows(hosts):
+        batch.append(row)
+        if len(batch) == chunk:
+            yield dict(zip(_names, map(list, zip(*batch))))
+            batch = []
+    if batch:
+        yield dict(zip(_names, map(list, zip(*batch))))
+
+
+def _timestamp(ts):
+    '''
+        Convert last_activity to float, NaN for None.
+    '''
+    return float("nan") if ts is None else float(ts)
+
+
+def _writeNpy(path, hosts, chunk):
+    numpy = _require("numpy")
+    from numpy.lib.format import open_memmap
+
+    # Hosts and their ports are listed up front, so that the number
+    # of rows and the rows written stay consistent
+    hosts = list(hosts)
+    count = sum(1 + len(ports) for _, _, ports in hosts)
+
+    # Text columns are made wide enough for the longest value
+    longest = {
+        "iface": max((len(name) for name, _, _ in hosts), default=0),
+        "mac": max((len(host.mac or "") for _, host, _ in hosts), default=0),
+        "os": max((len(host.os or "") for _, host, _ in hosts), default=0),
+    }
+    columns = [(name, "U{}".format(max(int(dtype[1:]), longest[name]))
+                if name in longest else dtype) for name, dtype in COLUMNS]
+
+    out = open_memmap(path, mode="w+", dtype=numpy.dtype(columns), shape=(count,))
+    pos = 0
+    for columns in _chunks(hosts, chunk):
+        size = len(columns["kind"])
+        for name in _names:
+            out[name][pos:pos + size] = columns[name]
+        pos += size
+    out.flush()
+    del out
+    return pos
+
+
+def _readNpy(path, chunk):
+    numpy = _require("numpy")
+    data = numpy.load(path, mmap_mode="r")
+    for start in range(0, len(data), chunk):
+        part = data[start:start + chunk]
+        yield {name: part[name].tolist() for name in _names}
+
+
+def _writeCsv(path, hosts, chunk):
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(_names)
+        for columns in _chunks(hosts, chunk):
+            columns["last_activity"] = ["" if math.isnan(ts) else repr(ts)
+                                        for ts in columns["last_activity"]]
+            writer.writerows(zip(*(columns[name] for name in _names)))
+            count += len(columns["kind"])
+    return count
+
+
+def _readCsv(path, chunk):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != _names:
+            raise Error("unexpected csv header: {}".format(header))
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) == chunk:
+                yield _parseCsv(batch)
+                batch = []
+        if batch:
+            yield _parseCsv(batch)
+
+
+def _parseCsv(rows):
+    '''
+        Convert chunk of csv rows (lists of strings) to columns.
+    '''
+    columns = dict(zip(_names, map(list, zip(*rows))))
+    for name, dtype in COLUMNS:
+        if dtype.startswith("u"):
+            columns[name] = [int(v) for v in columns[name]]
+    columns["last_activity"] = [float(v) if v else float("nan")
+                                for v in columns["last_activity"]]
+    return columns
+
+
+def _writeJsonl(path, hosts, chunk):
+    count = 0
+    with open(path, "w") as f:
+        for columns in _chunks(hosts, chunk):
+            columns["last_activity"] = [None if math.isnan(ts) else ts
+                                        for ts in columns["last_activity"]]
+            f.write(json.dumps(columns) + "\n")
+            count += len(columns["kind"])
+    return count
+
+
+def _readJsonl(path, chunk):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                columns = json.loads(line)
+                columns["last_activity"] = [float("nan") if ts is None else ts
+                                            for ts in columns["last_activity"]]
+                yield columns
+
+
+def _arrowSchema(pa):
+    '''
+        Return pyarrow schema of the columns.
+    '''
+    types = {"u1": pa.uint8(), "u2": pa.uint16(), "u4": pa.uint32(),
+             "f8": pa.float64()}
+    return pa.schema([(name, types.get(dtype, pa.string()))
+                      for name, dtype in COLUMNS])
+
+
+def _writeArrow(path, hosts, chunk, parquet=False):
+    pa = _require("pyarrow")
+    schema = _arrowSchema(pa)
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    count = 0
+    try:
+        for columns in _chunks(hosts, chunk):
+            columns["last_activity"] = [None if math.isnan(ts) else ts
+                                        for ts in columns["last_activity"]]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(columns["kind"])
+    finally:
+        writer.close()
+    return count
+
+
+def _readArrow(path, chunk, parquet=False):
+    pa = _require("pyarrow")
+    if parquet:
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk)
+    else:
+        reader = pa.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        columns = batch.to_pydict()
+        columns["last_activity"] = [float("nan") if ts is None else ts
+                                    for ts in columns["last_activity"]]
+        yield columns
+
+
+def _require(module):
+    '''
+        Import optional dependency. Raise Error if it is not installed.
+    '''
+    import importlib
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise Error("{} is required for this format".format(module))
+
+
+_writers = {
+    "npy": _writeNpy,
+    "csv": _writeCsv,
+    "jsonl": _writeJsonl,
+    "parquet": lambda path, hosts, chunk: _writeArrow(path, hosts, chunk, True),
+    "arrow": _writeArrow,
+}
+
+_readers = {
+    "npy": _readNpy,
+    "csv": _readCsv,
+    "jsonl": _readJsonl,
+    "parquet": lambda path, chunk: _readArrow(path, chunk, True),
+    "arrow": _readArrow,
+}
+
+
+def _load(localhost, columns, counts):
+    '''
+        Build hosts and ports of one chunk and merge them into LocalHost.
+        Every row of the chunk is validated before anything is merged,
+        and counts are updated only once the chunk is merged.
+        Hosts that have only port rows in the chunk are built with
+        unknown attributes, which never override a known host.
+    '''
+
+    # Hosts of this chunk, keys are (iface name, integer ip)
+    built = {}
+    chunk_counts = {"hosts": 0, "ports": 0, "skipped": 0}
+    for row in zip(*(columns[name] for name in _names)):
+        kind, iface, ip, mac, os, proto, number, state, seen = row
+        kind, ip, proto, number, state = map(int, (kind, ip, proto, number, state))
+        if kind not in (0, 1):
+            raise ValueError("invalid kind: {}".format(kind))
+        if not 0 <= state < len(STATES):
+            raise ValueError("invalid state code: {}".format(state))
+        if not 0 <= proto < len(PROTOS) or (kind == 1) != (proto > 0):
+            raise ValueError("invalid proto code: {}".format(proto))
+        address = util.int_to_ip(ip)
+        if iface not in localhost.interfaces:
+            chunk_counts["skipped"] += 1
+            continue
+        key = (iface, ip)
+        host = built.get(key)
+        if host is None:
+            host = built[key] = Host(address)
+        attrs = {
+            "state": STATES[state],
+            "last_activity": None if math.isnan(seen) else seen
+        }
+
+        if kind == 0:
+            attrs.update(mac=mac or None, os=os or None)
+            host.__dict__.update(attrs)
+            chunk_counts["hosts"] += 1
+        else:
+            port = Port(number, PROTOS[proto])
+            port.__dict__.update(attrs)
+            host.ports[port.proto][port.number] = port
+            chunk_counts["ports"] += 1
+
+    # Group hosts by interface and merge them in one go per interface
+    by_iface = {}
+    for (iface, _), host in built.items():
+        by_iface.setdefault(iface, []).append(host)
+    for iface, hosts in by_iface.items():
+        localhost.load(localhost.interfaces[iface], hosts)
+    for key, count in chunk_counts.items():
+        counts[key] += count
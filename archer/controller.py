@@ -1,6 +1,9 @@
 import os
 
-from .core import LocalHost, Interface, Host, Port, Job, MuxJob
+# Core submodules are imported on demand, when the name is first
+# referenced as core.<Name>. This keeps one-shot clients fast.
+from . import core
+from .dispatch import Dispatcher
 
 
 class Controller:
@@ -9,6 +12,12 @@ class Controller:
         It implements the interface for the UI to interact
         with network interfaces, remote hosts, remote TCP/UDP ports,
         launch jobs etc.
+        Controller may be shared between threads. Methods that modify
+        the inventory (update, create, delete, run etc.) are serialized
+        by LocalHost, while read methods (list, stat, listat, find, jobs,
+        info) take no locks and are never blocked by writers: they work
+        on copies of containers and of object attributes, which are taken
+        atomically.
     '''
 
     # General case error. When raised, error string contains human-readable
@@ -20,7 +29,8 @@ class Controller:
         '''
             Initialize controller by creating LocalHost instance.
         '''
-        self._localhost = LocalHost()
+        self._localhost = core.LocalHost()
+        self._dispatcher = Dispatcher()
 
 
     def list(self, path="/"):
@@ -39,7 +49,7 @@ class Controller:
         # if this proto on specified host
         if pstat["proto"]:
             return [str(port.number)
-                    for port in pstat["host"].ports[pstat["proto"]].values()]
+                    for port in list(pstat["host"].ports[pstat["proto"]].values())]
 
         # If path contains host - list all available transport protocols
         if pstat["host"]:
@@ -48,10 +58,10 @@ class Controller:
         # If path contains interface - list all the ip addresses of hosts
         # associated with this interface
         if pstat["interface"]:
-            return [host.ip for host in pstat["interface"].hosts.values()]
+            return [host.ip for host in list(pstat["interface"].hosts.values())]
 
         # Otherwise return names of all available interfaces
-        return [iface.name for iface in self._localhost.interfaces.values()]
+        return [iface.name for iface in list(self._localhost.interfaces.values())]
 
 
     def stat(self, path="/"):
@@ -95,7 +105,7 @@ class Controller:
         # stat all ports of this proto
         if pstat["proto"]:
             return [self._toJson(port)
-                    for port in pstat["host"].ports[pstat["proto"]].values()]
+                    for port in list(pstat["host"].ports[pstat["proto"]].values())]
 
         # If path string contains host - stat all ports of this host
         if pstat["host"]:
@@ -104,10 +114,11 @@ class Controller:
         # If path string contains interface - stat all hosts bound to it
         if pstat["interface"]:
             return [self._toJson(host)
-                    for host in pstat["interface"].hosts.values()]
+                    for host in list(pstat["interface"].hosts.values())]
 
         # Otherwise stat all interfaces
-        return [self._toJson(iface) for iface in self._localhost.interfaces.values()]
+        return [self._toJson(iface)
+                for iface in list(self._localhost.interfaces.values())]
 
 
     def create(self, path, name):
@@ -115,42 +126,50 @@ class Controller:
             Create subdevice with given path.
         '''
 
-        # Parse path string
-        pstat = self._parsePath(path)
-
-        # Nothing can be created under port
-        if pstat["port"]:
-            raise self.Error("can not create subdevice to port")
+        # Path is resolved and changed by one writer, so that nothing
+        # it refers to is dropped in between
+        with self._localhost.lock:
 
-        # If we have protocol, create a port
-        if pstat["proto"]:
-            try:
-                port = Port(int(name), pstat["proto"])
-            except Port.InvalidNumber:
-                raise self.Error("invalid port: {}/{}".format(pstat["proto"], name))
-            try:
-                pstat["host"].addPort(port)
-            except Host.DuplicateError:
-                raise self.Error("port exists: {}/{}".format(path, name))
+            # Parse path string
+            pstat = self._parsePath(path)
 
-        # Transport protocols are not creatable
-        elif pstat["host"]:
-            raise self.Error("can not create transport protocol")
+            # Nothing can be created under port
+            if pstat["port"]:
+                raise self.Error("can not create subdevice to port")
 
-        # If we only have interface, create host
-        elif pstat["interface"]:
-            try:
-                host = Host(name)
-            except Host.IPError:
-                raise self.Error("invalid ip address: {}".format(name))
-            try:
-                pstat["interface"].addHost(host)
-            except Interface.DuplicateError:
-                raise self.Error("host exists: {}/{}".format(path, name))
+            # If we have protocol, create a port
+            if pstat["proto"]:
+                try:
+                    port = core.Port(int(name), pstat["proto"])
+                except (ValueError, core.Port.NumberError):
+                    raise self.Error("invalid port: {}/{}".format(pstat["proto"], name))
+                try:
+                    self._localhost.addPort(pstat["host"], port)
+                except core.Host.DuplicateError:
+                    raise self.Error("port exists: {}/{}".format(path, name))
+                except core.LocalHost.ObjectError:
+                    raise self.Error("host not found: {}".format(path))
+
+            # Transport protocols are not creatable
+            elif pstat["host"]:
+                raise self.Error("can not create transport protocol")
+
+            # If we only have interface, create host
+            elif pstat["interface"]:
+                try:
+                    host = core.Host(name)
+                except core.Host.IPError:
+                    raise self.Error("invalid ip address: {}".format(name))
+                try:
+                    self._localhost.addHost(pstat["interface"], host)
+                except core.Interface.DuplicateError:
+                    raise self.Error("host exists: {}/{}".format(path, name))
+                except core.LocalHost.ObjectError:
+                    raise self.Error("interface not found: {}".format(path))
 
-        # Interfaces are not creatable
-        else:
-            raise self.Error("can not create interface")
+            # Interfaces are not creatable
+            else:
+                raise self.Error("can not create interface")
 
 
     def delete(self, path):
@@ -158,42 +177,182 @@ class Controller:
             Delete device given by path.
         '''
 
-        # Parse path
-        pstat = self._parsePath(path)
+        # Path is resolved and changed by one writer, so that nothing
+        # it refers to is dropped in between
+        with self._localhost.lock:
 
-        # If port in path - drop it:
-        if pstat["port"]:
-            pstat["host"].dropPort(pstat["port"])
+            # Parse path
+            pstat = self._parsePath(path)
 
-        # If transport protocol in path, it is an Error
-        elif pstat["proto"]:
-            raise self.Error("can not drop protocol")
+            # If port in path - drop it:
+            if pstat["port"]:
+                try:
+                    self._localhost.dropPort(pstat["host"], pstat["port"])
+                except core.Host.ObjectError:
+                    raise self.Error("port not found: {}".format(path))
 
-        # If host in path - drop it
-        elif pstat["host"]:
-            pstat["interface"].dropHost(pstat["host"])
+            # If transport protocol in path, it is an Error
+            elif pstat["proto"]:
+                raise self.Error("can not drop protocol")
 
-        # Interfaces are not dropable
-        elif pstat["interface"]:
-            raise self.Error("can not drop interface")
+            # If host in path - drop it
+            elif pstat["host"]:
+                try:
+                    self._localhost.dropHost(pstat["interface"], pstat["host"])
+                except core.Interface.ObjectError:
+                    raise self.Error("host not found: {}".format(path))
 
-        # Localhost is not dropable too
-        else:
-            raise self.Error("can not drop localhost")
+            # Interfaces are not dropable
+            elif pstat["interface"]:
+                raise self.Error("can not drop interface")
+
+            # Localhost is not dropable too
+            else:
+                raise self.Error("can not drop localhost")
 
 
     def update(self):
         '''
             Update localhost. Return events generated by it almost untouched,
             but replace object references with pathes to those objects.
+            Events are also delivered to matching subscribers
+            (see subscribe).
         '''
-        events = self._localhost.update()
+
+        # Paths are resolved before other writers can drop the objects
+        with self._localhost.lock:
+            events = self._localhost.update()
+            for ev in events:
+                if "object" in ev:
+                    ev["device"] = self._pathToObject(ev.pop("object"))
+
+        self._dispatcher.flush()
         for ev in events:
-            if "object" in ev:
-                ev["device"] = self._pathToObject(ev.pop("object"))
+            self._dispatcher.dispatch(ev)
         return events
 
 
+    def subscribe(self, path, types, target, backlog=1000):
+        '''
+            Subscribe to events generated by update() for devices under
+            given path. Path may address a network instead of a single
+            host, e.g. /eth0/10.0.0.0/24/tcp. Types is event type
+            or list of event types, None for all types. Target is
+            a callable that is called with every event, or a queue.Queue
+            that events are put to. A callable is called from a thread
+            of its own, never from update(), so a slow subscriber does not
+            hold back update() or other subscribers. While the callable is
+            busy or the queue is full, undelivered events are coalesced
+            (only the latest event of each device and type is kept),
+            and at most backlog of them are held.
+            Return subscription id.
+        '''
+        try:
+            sub = self._dispatcher.subscribe(path, types, target, backlog)
+        except Dispatcher.PathError as exc:
+            raise self.Error("invalid subscription path: {}".format(str(exc)))
+        except TypeError:
+            raise self.Error("subscription target is neither callable nor queue")
+        return sub.id
+
+
+    def unsubscribe(self, sid):
+        '''
+            Cancel subscription with given id.
+        '''
+        try:
+            self._dispatcher.unsubscribe(sid)
+        except KeyError:
+            raise self.Error("no subscription found with id {}".format(sid))
+
+
+    def subscription(self, sid):
+        '''
+            Return properties of subscription with given id.
+        '''
+        try:
+            sub = self._dispatcher.get(sid)
+        except KeyError:
+            raise self.Error("no subscription found with id {}".format(sid))
+        return {
+            "path": sub.prefix,
+            "types": sorted(sub.types) if sub.types is not None else None,
+            "backlog": len(sub.backlog),
+            "coalesced": sub.coalesced,
+            "dropped": sub.dropped,
+            "errors": sub.errors
+        }
+
+
+    def find(self, expr):
+        '''
+            Find hosts or ports matching query expression, e.g.
+            "hosts where tcp/22=open and os=linux" or
+            "ports where state=filtered and seen<1h"
+            (see core.Query for the language).
+            Return generator of paths of matching devices.
+        '''
+        try:
+            objs = self._localhost.find(expr)
+        except core.Query.Error as exc:
+            raise self.Error("invalid query: {}".format(str(exc)))
+        return self._paths(objs)
+
+
+    def setTtl(self, ttl, interface=None, kind=None):
+        '''
+            Set time (in seconds) after which hosts and ports that have
+            shown no activity are marked stale. TTL of None disables it.
+            Interface is interface name and kind is "host", "tcp" or "udp";
+            if omitted, TTL applies to all interfaces or kinds.
+        '''
+        if kind not in (None, "host", "tcp", "udp"):
+            raise self.Error("unknown kind: {}".format(kind))
+        try:
+            self._localhost.setTtl(ttl, interface, kind)
+        except (TypeError, ValueError):
+            raise self.Error("invalid ttl: {}".format(ttl))
+
+
+    def export(self, path, format=None):
+        '''
+            Export all the interfaces, hosts and ports to file in columnar
+            format: "npy", "csv", "jsonl", "parquet" or "arrow" (see
+            archer.columnar). If format is omitted, it is guessed by file
+            extension. Return number of rows written.
+        '''
+        from . import columnar
+
+        format = format or columnar.guessFormat(path)
+        try:
+            return columnar.export(self._localhost, path, format)
+        except columnar.Error as exc:
+            raise self.Error("export failed: {}".format(str(exc)))
+        except OSError as exc:
+            raise self.Error("export failed: {}".format(exc.strerror))
+
+
+    def import_(self, path, format=None):
+        '''
+            Import hosts and ports from file written by export and merge
+            them into inventory. If format is omitted, it is guessed
+            by file extension. Return dict with numbers of imported
+            hosts, ports and rows skipped because of unknown interface.
+            File is merged in chunks: if it turns out malformed, chunks
+            before the malformed one stay imported, and the error message
+            tells how many hosts and ports they had.
+        '''
+        from . import columnar
+
+        format = format or columnar.guessFormat(path)
+        try:
+            return columnar.import_(self._localhost, path, format)
+        except columnar.Error as exc:
+            raise self.Error("import failed: {}".format(str(exc)))
+        except OSError as exc:
+            raise self.Error("import failed: {}".format(exc.strerror))
+
+
     def jobs(self, path="/"):
         '''
             List job ids of all the jobs that are running
@@ -222,13 +381,48 @@ class Controller:
         return self._toJson(self._getJob(jid))
 
 
+    def memory(self, jid=None):
+        '''
+            Return memory accounting of job with given jid,
+            or of all the jobs if jid is omitted.
+        '''
+        if jid is not None:
+            job = self._getJob(jid)
+            return {
+                "id": job.id,
+                "bytes": job.memoryUsage(),
+                "compacted": isinstance(job, core.JobSummary)
+            }
+        return self._localhost.governor.usage(self._localhost.jobs)
+
+
+    def setRetention(self, **limits):
+        '''
+            Change retention policy of finished jobs. Accepted limits:
+            max_jobs, max_bytes, max_age (seconds), max_summaries and
+            tail (characters of output kept in summary); None disables
+            a limit. Finished jobs beyond the limits are compacted into
+            summaries, and evicted once too old (see core.RetentionPolicy).
+        '''
+        policy = self._localhost.governor.policy
+        for name, value in limits.items():
+            if not hasattr(policy, name):
+                raise self.Error("unknown retention limit: {}".format(name))
+            if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                raise self.Error("invalid value of {}: {}".format(name, value))
+            if value is None and name == "tail":
+                raise self.Error("tail can not be disabled")
+        for name, value in limits.items():
+            setattr(policy, name, value)
+
+
     def signal(self, jid, signal="term"):
         '''
             Send specified signal to the job with given job id.
         '''
         try:
             self._getJob(jid).signal(signal)
-        except Job.SignalError:
+        except core.Job.SignalError:
             # No such signal
             raise self.Error("no such signal: {}".format(signal))
 
@@ -237,7 +431,10 @@ class Controller:
         '''
             Read stdout of job with given id.
         '''
-        return self._getJob(jid).read()
+
+        # Output buffers are filled by update() under the same lock
+        with self._localhost.lock:
+            return self._getJob(jid).read()
 
 
     def write(self, jid, data):
@@ -258,10 +455,10 @@ class Controller:
 
         # Create a job
         try:
-            job = Job(jobname, pstat)
-        except Job.NameError:
+            job = core.Job(jobname, pstat)
+        except core.Job.NameError:
             raise self.Error("job manifest not found: {}".format(jobname))
-        except Job.ContextError as exc:
+        except core.Job.ContextError as exc:
             raise self.Error("inappropriate context for job: {}".format(str(exc)))
 
         # Add a job to localhost
@@ -270,22 +467,37 @@ class Controller:
         return job.id
 
 
-    def runMux(self, jobname, contexts):
+    def runMux(self, jobname, contexts, backlog=core.MuxJob.BACKLOG,
+               quota=core.MuxJob.QUOTA):
         '''
             Run multiple instances of the same job in different contexts.
             Those instances are counted as one job (aka multiplexed job).
+            Output of the instances is merged fairly: every read() takes
+            at most quota characters of output of each instance.
+            Backlog limits unread output of an instance: once read() has
+            been called, an instance whose output is not consumed beyond
+            backlog characters is paused until it is. This bounds memory
+            of the job, but a caller that stops calling read() stalls
+            the job, which then never finishes and is never compacted.
+            Until the first read(), and with backlog of None, output is
+            kept without limit and the job is never paused.
             Return id of this job.
         '''
 
+        if backlog is not None and (not isinstance(backlog, int) or backlog <= 0):
+            raise self.Error("invalid value of backlog: {}".format(backlog))
+        if not isinstance(quota, int) or quota <= 0:
+            raise self.Error("invalid value of quota: {}".format(quota))
+
         # Parse all contexts
         pstats = [self._parsePath(cont) for cont in contexts]
 
         # Create multiplexed job
         try:
-            job = MuxJob(jobname, pstats)
-        except Job.NameError:
+            job = core.MuxJob(jobname, pstats, backlog, quota)
+        except core.Job.NameError:
             raise self.Error("job manifest not found: {}".format(jobname))
-        except Job.ContextError as exc:
+        except core.Job.ContextError as exc:
             raise self.Error("inappropriate context for job: {}".format(str(exc)))
 
         # Add job to localhost
@@ -294,6 +506,49 @@ class Controller:
         return job.id
 
 
+    def addAgent(self, address, token=None):
+        '''
+            Register worker agent at "host:port" address (see archer.agent).
+            Token is the secret the agent was started with; by default
+            it is taken from ARCHER_AGENT_TOKEN environment variable.
+            Jobs that are run afterwards are executed by agents:
+            the least loaded agent gets the job, and multiplexed jobs
+            are spread across all of them. If an agent is lost, its jobs
+            are restarted elsewhere, and their output is repeated
+            after a marker line.
+        '''
+        try:
+            self._localhost.addAgent(address, token)
+        except core.AgentPool.ConnectError as exc:
+            raise self.Error("can not connect to agent {}: {}".format(address, str(exc)))
+
+
+    def dropAgent(self, address):
+        '''
+            Unregister worker agent. Its unfinished jobs are moved
+            to other agents.
+        '''
+        try:
+            self._localhost.dropAgent(address)
+        except KeyError:
+            raise self.Error("no agent found: {}".format(address))
+
+
+    def agents(self):
+        '''
+            List registered worker agents with their load.
+        '''
+        pool = self._localhost.agents
+        if pool is None:
+            return []
+        return [{
+            "address": agent.address,
+            "capacity": agent.capacity,
+            "running": len(agent.jobs),
+            "load": agent.load
+        } for agent in list(pool.agents.values())]
+
+
     def drop(self, jid):
         '''
             Delete job with given id. Job needs to be not running.
@@ -301,7 +556,7 @@ class Controller:
         job = self._getJob(jid)
         try:
             self._localhost.dropJob(job)
-        except LocalHost.JobRunningError:
+        except core.LocalHost.JobRunningError:
             raise self.Error("the job is still running")
 
 
@@ -372,13 +627,13 @@ class Controller:
             Convert object to JSON representation.
         '''
 
-        if isinstance(obj, LocalHost):
+        if isinstance(obj, core.LocalHost):
             return {
                 "username": obj.username,
                 "hostname": obj.hostname
             }
 
-        if isinstance(obj, Interface):
+        if isinstance(obj, core.Interface):
             return {
                 "name": obj.name,
                 "ip": obj.ip,
@@ -388,21 +643,39 @@ class Controller:
                 "state": obj.state
             }
 
-        if isinstance(obj, Host):
+        # Attributes of hosts and ports are read from one copy, taken
+        # atomically, so that a concurrent setAttrs is seen in full or not at all
+        if isinstance(obj, core.Host):
+            attrs = vars(obj).copy()
             return {
-                "ip": obj.ip,
-                "mac": obj.mac,
-                "os": obj.os,
-                "last_activity": obj.last_activity,
-                "state": obj.state
+                "ip": attrs["ip"],
+                "mac": attrs["mac"],
+                "os": attrs["os"],
+                "last_activity": attrs["last_activity"],
+                "state": attrs["state"]
             }
 
-        if isinstance(obj, Port):
+        if isinstance(obj, core.Port):
+            attrs = vars(obj).copy()
             return {
-                "number": obj.number,
-                "proto": obj.proto,
-                "last_activity": obj.last_activity,
-                "state": obj.state
+                "number": attrs["number"],
+                "proto": attrs["proto"],
+                "last_activity": attrs["last_activity"],
+                "state": attrs["state"]
+            }
+
+        if hasattr(obj, "isRunning"):
+            stats = self._localhost.governor.stats.get(obj.id) or {}
+            return {
+                "id": obj.id,
+                "name": obj.name,
+                "state": obj.state,
+                "return_code": obj.return_code,
+                "started": stats.get("started"),
+                "finished": stats.get("finished"),
+                "events": stats.get("events"),
+                "bytes": obj.memoryUsage(),
+                "compacted": isinstance(obj, core.JobSummary)
             }
 
         raise ValueError("Unknown object: {}".format(obj.__class__.__name__))
@@ -421,19 +694,31 @@ class Controller:
 
         if len(devs) >= 1:
             names.append(devs[0].name)
-        elif len(devs) >= 2:
+        if len(devs) >= 2:
             names.append(devs[1].ip)
-        elif len(devs >= 3):
-            names += [devs[2].proto, int(devs[2].number)]
+        if len(devs) >= 3:
+            names += [devs[2].proto, str(devs[2].number)]
 
         return "/" + "/".join(names)
 
 
+    def _paths(self, objs):
+        '''
+            Return generator of paths to given objects. Objects that
+            were deleted by the time their path is built are skipped.
+        '''
+        for obj in objs:
+            try:
+                yield self._pathToObject(obj)
+            except core.LocalHost.ObjectError:
+                continue
+
+
     def _getJob(self, jid):
         '''
             Get job by job id. Raise self.Error if no job with such jid found.
         '''
         try:
-            job = self._localhost.jobs[jid]
+            return self._localhost.jobs[jid]
         except KeyError:
             raise self.Error("no job found with id {}".format(jid))
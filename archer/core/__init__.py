@@ -1,7 +1,42 @@
+'''
+    Core components of archer. Submodules are imported on demand:
+    the first access to a name (e.g. "from .core import Port")
+    imports only the submodule that defines it, so that short-lived
+    clients do not pay for the modules they never use.
+'''
 
-from .localhost import LocalHost
-from .interface import Interface
-from .host import Host
-from .port import Port
-from .job import Job
-from .muxjob import MuxJob
+import importlib
+
+
+# Keys are exported names, values are submodules that define them
+_exports = {
+    "LocalHost": "localhost",
+    "Interface": "interface",
+    "Host": "host",
+    "Port": "port",
+    "Job": "job",
+    "MuxJob": "muxjob",
+    "Query": "query",
+    "AgentPool": "remote",
+    "RemoteJob": "remote",
+    "RetentionPolicy": "retention",
+    "JobSummary": "retention",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    '''
+        Import the submodule that defines given name and return the name.
+        The result is cached in module globals, so this function is called
+        at most once per name.
+    '''
+    try:
+        module = _exports[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}"
+                             .format(__name__, name))
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
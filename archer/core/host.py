@@ -53,7 +53,10 @@ class Host:
         '''
             Return list of all the Port objects of this host.
         '''
-        return [port for proto in self.ports for port in self.ports[proto]]
+        # Copies of containers are taken at once, so that concurrent
+        # addPort/dropPort do not break the iteration
+        return [port for ports in list(self.ports.values())
+                for port in list(ports.values())]
 
 
     def addPort(self, port):
@@ -62,6 +65,9 @@ class Host:
             Raise self.DuplicateError if port with this protocol/number
             pair already exists.
         '''
+        if port.number in self.ports[port.proto]:
+            raise self.DuplicateError
+        self.ports[port.proto][port.number] = port
 
 
     def dropPort(self, port):
@@ -69,3 +75,6 @@ class Host:
             Delete port from this host.
             Raise ObjectError if this port object does not belong to this Host.
         '''
+        if self.ports[port.proto].get(port.number) is not port:
+            raise self.ObjectError
+        del self.ports[port.proto][port.number]
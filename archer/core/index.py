@@ -0,0 +1,223 @@
+import bisect
+
+from .. import util
+
+
+class Index:
+    '''
+        Secondary indexes over Host and Port objects of a LocalHost.
+        LocalHost keeps the indexes current: it calls add/remove when
+        objects join or leave the inventory and change() whenever it
+        assigns an indexed attribute. Indexes are used by Query to find
+        objects without walking every interface, host and port.
+    '''
+
+    # Indexed attributes. Keys are object kinds, values - attribute names
+    # which are indexed by equality
+    ATTRS = {
+        "host": ("state", "os", "mac"),
+        "port": ("state", "proto", "number"),
+    }
+
+
+    def __init__(self):
+        self.parents = {} # keys are Host/Port objects, values - parent objects
+        self.objects = {"host": set(), "port": set()} # all indexed objects
+
+        # Equality indexes: kind -> attribute -> value -> set of objects
+        self.values = {kind: {attr: {} for attr in attrs}
+                       for kind, attrs in self.ATTRS.items()}
+
+        # Range indexes of last activity timestamps
+        self.activity = {"host": Timeline(), "port": Timeline()}
+
+        # Hosts by ip address: integer addresses are kept in sorted lists,
+        # one per /16 block, so that an insert or delete shifts at most
+        # one block. Blocks are the keys of self.ips, their sorted list
+        # is self.blocks. Dict of sets of hosts with each address.
+        self.ips = {}
+        self.blocks = []
+        self.hosts_by_ip = {}
+
+
+    def add(self, obj, parent):
+        '''
+            Add Host or Port object to indexes.
+        '''
+        kind = self.kind(obj)
+        self.parents[obj] = parent
+        self.objects[kind].add(obj)
+        for attr, index in self.values[kind].items():
+            index.setdefault(getattr(obj, attr), set()).add(obj)
+        if obj.last_activity is not None:
+            self.activity[kind].add(obj, obj.last_activity)
+
+        if kind == "host":
+            addr = util.ip_to_int(obj.ip)
+            if addr not in self.hosts_by_ip:
+                block = addr >> 16
+                if block not in self.ips:
+                    bisect.insort(self.blocks, block)
+                    self.ips[block] = []
+                bisect.insort(self.ips[block], addr)
+                self.hosts_by_ip[addr] = set()
+            self.hosts_by_ip[addr].add(obj)
+
+
+    def remove(self, obj):
+        '''
+            Remove Host or Port object from indexes.
+        '''
+        kind = self.kind(obj)
+        del self.parents[obj]
+        self.objects[kind].discard(obj)
+        for attr, index in self.values[kind].items():
+            _discard(index, getattr(obj, attr), obj)
+        if obj.last_activity is not None:
+            self.activity[kind].remove(obj, obj.last_activity)
+
+        if kind == "host":
+            addr = util.ip_to_int(obj.ip)
+            _discard(self.hosts_by_ip, addr, obj)
+            if addr not in self.hosts_by_ip:
+                block = addr >> 16
+                addrs = self.ips[block]
+                del addrs[bisect.bisect_left(addrs, addr)]
+                if not addrs:
+                    del self.ips[block]
+                    del self.blocks[bisect.bisect_left(self.blocks, block)]
+
+
+    def change(self, obj, attr, old, new):
+        '''
+            Reflect change of object attribute from old to new value.
+            Should be called for every attribute change of indexed object.
+        '''
+        kind = self.kind(obj)
+        if attr == "last_activity":
+            if old is not None:
+                self.activity[kind].remove(obj, old)
+            if new is not None:
+                self.activity[kind].add(obj, new)
+        elif attr in self.values[kind]:
+            index = self.values[kind][attr]
+            _discard(index, old, obj)
+            index.setdefault(new, set()).add(obj)
+
+
+    def hostsInNetwork(self, network, length):
+        '''
+            Return generator of hosts whose ip address is
+            within given network (integer address, prefix length).
+        '''
+        return (host for addrs, lo, hi in self._ranges(network, length)
+                for addr in addrs[lo:hi]
+                for host in list(self.hosts_by_ip.get(addr, ())))
+
+
+    def countInNetwork(self, network, length):
+        '''
+            Return number of distinct addresses within given network.
+        '''
+        return sum(hi - lo for _, lo, hi in self._ranges(network, length))
+
+
+    def _ranges(self, network, length):
+        '''
+            Return generator of (addresses, lo, hi) tuples: addresses[lo:hi]
+            are the addresses of one /16 block within given network.
+        '''
+        first = network & ((0xffffffff << (32 - length)) & 0xffffffff)
+        last = first | (0xffffffff >> length)
+        start = bisect.bisect_left(self.blocks, first >> 16)
+        end = bisect.bisect_right(self.blocks, last >> 16)
+        for block in self.blocks[start:end]:
+            addrs = self.ips.get(block, [])
+            yield (addrs, bisect.bisect_left(addrs, first),
+                   bisect.bisect_right(addrs, last))
+
+
+    @staticmethod
+    def kind(obj):
+        '''
+            Return kind of indexed object: "host" or "port".
+        '''
+        return "port" if hasattr(obj, "proto") else "host"
+
+
+class Timeline:
+    '''
+        Range index of timestamps. Objects are kept in buckets of
+        fixed width, so that a range lookup touches only the buckets
+        that intersect the range.
+    '''
+
+    WIDTH = 60 # bucket width in seconds
+
+
+    def __init__(self):
+        self.buckets = {} # keys are bucket numbers, values - {object: timestamp}
+        self.keys = [] # sorted list of bucket numbers
+
+
+    def add(self, obj, ts):
+        '''
+            Add object with given timestamp.
+        '''
+        key = int(ts // self.WIDTH)
+        if key not in self.buckets:
+            bisect.insort(self.keys, key)
+            self.buckets[key] = {}
+        self.buckets[key][obj] = ts
+
+
+    def remove(self, obj, ts):
+        '''
+            Remove object that was added with given timestamp.
+        '''
+        key = int(ts // self.WIDTH)
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.pop(obj, None) is None:
+            return
+        if not bucket:
+            del self.buckets[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+
+    def range(self, lo=None, hi=None):
+        '''
+            Return generator of objects with lo <= timestamp < hi.
+            None means the range is unbounded on that side.
+        '''
+        for key in self._keys(lo, hi):
+            for obj, ts in list(self.buckets.get(key, {}).items()):
+                if (lo is None or ts >= lo) and (hi is None or ts < hi):
+                    yield obj
+
+
+    def count(self, lo=None, hi=None):
+        '''
+            Return upper estimate of the number of objects in range.
+        '''
+        return sum(len(self.buckets.get(key, ())) for key in self._keys(lo, hi))
+
+
+    def _keys(self, lo, hi):
+        '''
+            Return list of bucket numbers that intersect the range.
+        '''
+        start = 0 if lo is None else bisect.bisect_left(self.keys, int(lo // self.WIDTH))
+        end = (len(self.keys) if hi is None
+               else bisect.bisect_right(self.keys, int(hi // self.WIDTH)))
+        return self.keys[start:end]
+
+
+def _discard(index, key, obj):
+    '''
+        Remove object from set index[key], deleting the set if it gets empty.
+    '''
+    objs = index.get(key)
+    if objs is not None:
+        objs.discard(obj)
+        if not objs:
+            del index[key]
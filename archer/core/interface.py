@@ -1,3 +1,5 @@
+import os
+
 
 class Interface:
     '''
@@ -6,6 +8,9 @@ class Interface:
         that have been descovered behind this interface.
         Interface attributes are immutable - "update" method returns
         new Interface object if anything changed.
+        Interface parameters are gathered lazily: nothing is read from
+        the system until the first parameter of a group (link, address
+        or route) is accessed.
     '''
 
 
@@ -21,23 +26,38 @@ class Interface:
     class DuplicateError(Error): pass
 
 
+    # ioctl request codes used to query interface addresses (linux)
+    _SIOCGIFADDR = 0x8915
+    _SIOCGIFNETMASK = 0x891b
+
+
     def __init__(self, name):
         '''
-            Initialize instance by gathering interface parameters:
-            ip address, network mask, mac address, gateway address, state.
-            Raise ValueError if interface with such name is not found.
+            Initialize instance with interface name. Interface parameters:
+            ip address, network mask, mac address, gateway address, state
+            are gathered on first access.
         '''
 
         self.name = name # interface name
-        self.mac = "" # mac address
-        self.ip = "" # ip address
-        self.mask = "" # network mask in full format, e.g. 255.255.255.0
-        self.gateway = "" # address of gateway
-        self.state = "" # interface state (either 'up' or 'down')
+        self._params = {} # gathered parameters, filled by _load* methods
 
         self.hosts = {} # keys are host ip addresses, values are Host objects
 
 
+    # Every parameter is read by the loader of its group. Loaders
+    # fill self._params with all the parameters of the group at once.
+    # mac address
+    mac = property(lambda self: self._param("mac", self._loadLink))
+    # interface state (either 'up' or 'down')
+    state = property(lambda self: self._param("state", self._loadLink))
+    # ip address
+    ip = property(lambda self: self._param("ip", self._loadAddress))
+    # network mask in full format, e.g. 255.255.255.0
+    mask = property(lambda self: self._param("mask", self._loadAddress))
+    # address of gateway
+    gateway = property(lambda self: self._param("gateway", self._loadRoute))
+
+
     def update(self):
         '''
             Check if network interface parameters have changed.
@@ -47,12 +67,22 @@ class Interface:
             If it is not desired, client should delete them manually.
         '''
 
+        fresh = Interface(self.name)
+        keys = ["mac", "state", "ip", "mask", "gateway"]
+        if all(getattr(fresh, key) == getattr(self, key) for key in keys):
+            return self
+        fresh.hosts = self.hosts
+        return fresh
+
 
     def addHost(self, host):
         '''
             Add host object to this interface. Raise self.DuplicateError
             if host with given ip address already exists.
         '''
+        if host.ip in self.hosts:
+            raise self.DuplicateError
+        self.hosts[host.ip] = host
 
 
     def dropHost(self, host):
@@ -60,3 +90,76 @@ class Interface:
             Delete host from the list of known hosts.
             Raise ObjectError if host does not belong to this interface.
         '''
+        if self.hosts.get(host.ip) is not host:
+            raise self.ObjectError
+        del self.hosts[host.ip]
+
+
+    def _param(self, key, loader):
+        '''
+            Return interface parameter, calling its group loader
+            if the parameter has not been gathered yet.
+        '''
+        if key not in self._params:
+            loader()
+        return self._params[key]
+
+
+    def _loadLink(self):
+        '''
+            Gather link layer parameters: mac address and state.
+        '''
+        base = os.path.join("/sys/class/net", self.name)
+        try:
+            with open(os.path.join(base, "address")) as f:
+                self._params["mac"] = f.read().strip()
+        except OSError:
+            self._params["mac"] = ""
+        try:
+            with open(os.path.join(base, "flags")) as f:
+                flags = int(f.read().strip(), 16)
+            self._params["state"] = "up" if flags & 0x1 else "down"
+        except (OSError, ValueError):
+            self._params["state"] = ""
+
+
+    def _loadAddress(self):
+        '''
+            Gather network layer parameters: ip address and network mask.
+        '''
+        import fcntl, socket, struct
+
+        request = struct.pack("256s", self.name[:15].encode())
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for key, code in [("ip", self._SIOCGIFADDR),
+                              ("mask", self._SIOCGIFNETMASK)]:
+                try:
+                    reply = fcntl.ioctl(sock.fileno(), code, request)
+                    self._params[key] = socket.inet_ntoa(reply[20:24])
+                except OSError:
+                    self._params[key] = ""
+        finally:
+            sock.close()
+
+
+    def _loadRoute(self):
+        '''
+            Gather default gateway address from the kernel routing table.
+        '''
+        self._params["gateway"] = ""
+        try:
+            with open("/proc/net/route") as f:
+                lines = f.read().splitlines()[1:]
+        except OSError:
+            return
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 3 or fields[0] != self.name:
+                continue
+            if fields[1] == "00000000":
+                # Gateway is stored as little-endian hex
+                addr = int(fields[2], 16)
+                self._params["gateway"] = ".".join(
+                    str((addr >> shift) & 0xff) for shift in (0, 8, 16, 24))
+                return
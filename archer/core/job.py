@@ -46,10 +46,11 @@ class Job:
 
         self.name = name # job manifest name
         self.context = context # job context
-        self.jid = None # job id, assigned by LocalHost before running
+        self.id = None # job id, assigned by LocalHost before running
         self.pid = None # os proccess id, assigned when run
         self.state = "init" # job state
         self.return_code = None # job return code
+        self._buffer = "" # stdout collected by update() and not yet read
 
 
     def run(self):
@@ -69,6 +70,10 @@ class Job:
             and self.return_code.
         '''
 
+        # ...
+        # self._buffer += <data read from stdout>, so that read()
+        # returns it and memoryUsage() accounts it until then
+
 
     def read(self):
         '''
@@ -76,6 +81,8 @@ class Job:
             Note: should be called only after update() because this method
             does not actually communicate with subproccess.
         '''
+        data, self._buffer = self._buffer, ""
+        return data
 
 
     def write(self, data):
@@ -95,3 +102,10 @@ class Job:
         '''
             Return True if job is running now.
         '''
+
+
+    def memoryUsage(self):
+        '''
+            Return approximate number of bytes taken by job buffers.
+        '''
+        return len(self._buffer)
@@ -1,9 +1,38 @@
 
+import functools
+import threading
+import time
+
+from .index import Index
+from .retention import Governor
+from .wheel import TimingWheel
+
+
+def _writer(method):
+    '''
+        Decorator for LocalHost methods that modify it.
+        Such methods are serialized by LocalHost.lock.
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class LocalHost:
     '''
-        The top-level class of the core components. Does discovery of
-        local network interfaces upon instantiation, stores jobs
+        The top-level class of the core components. Discovers local user,
+        host name and network interfaces on first access, stores jobs
         and collects messages from them.
+        Concurrency model: one writer at a time, any number of readers.
+        Methods that modify LocalHost or its network objects are serialized
+        by self.lock. Readers take no locks: every container copy they make
+        (list(d.values()) and alike) is atomic, and setAttrs changes
+        all attributes of an object in one atomic step. A reader that
+        takes several attributes of an object at once should read them
+        from a copy of its __dict__ (vars(obj).copy()), then it sees
+        the object either before or after a write, never in between.
     '''
 
 
@@ -18,26 +47,99 @@ class LocalHost:
     class JobRunningError(Error): pass
 
 
+    # State that hosts and ports get when nothing has been heard of them
+    # for longer than their time to live. Activity seen afterwards brings
+    # back the state the object had before it expired.
+    EXPIRED_STATE = "stale"
+
+    # Default time to live of hosts and ports, in seconds
+    DEFAULT_TTL = 3600
+
+
     def __init__(self):
         '''
-            Initialize LocalHost instance by getting user name and host name
-            and discovering network interfaces.
+            Initialize LocalHost instance. User name, host name and
+            network interfaces are discovered lazily, when first accessed.
         '''
 
-        self.username = "" # name of local user that runs thos proccess
-        self.hostname = "" # name of the host machine
-        self.interfaces = {} # keys are interfaces names, values - Interface objects
+        self._username = None # name of local user that runs thos proccess
+        self._hostname = None # name of the host machine
+        self._interfaces = None # keys are interfaces names, values - Interface objects
         self.jobs = {} # keys are job ids, values - Job or MuxJob objects
+        self.lock = threading.RLock() # serializes writers, see class docstring
+        self.agents = None # AgentPool, created when the first agent is added
+        self._next_jid = 1 # id of the next added job
+        self.governor = Governor() # retention policy of finished jobs
+        self._index = Index() # secondary indexes of hosts and ports
+        self._wheel = TimingWheel(time.time()) # expiry times of hosts and ports
+        self._ttls = {(None, None): self.DEFAULT_TTL} # see setTtl
+        self._expired = {} # keys are expired objects, values - states before expiry
+
+
+    @property
+    def username(self):
+        '''
+            Name of local user that runs this proccess.
+        '''
+        if self._username is None:
+            import getpass
+            try:
+                self._username = getpass.getuser()
+            except (OSError, KeyError):
+                self._username = ""
+        return self._username
 
 
+    @property
+    def hostname(self):
+        '''
+            Name of the host machine.
+        '''
+        if self._hostname is None:
+            import socket
+            self._hostname = socket.gethostname()
+        return self._hostname
+
+
+    @property
+    def interfaces(self):
+        '''
+            Dict of network interfaces: keys are interface names,
+            values - Interface objects. Only interface names are
+            discovered here; each Interface gathers its parameters
+            on first access.
+        '''
+        if self._interfaces is None:
+            # Discovered once: concurrent first readers wait for the first one
+            with self.lock:
+                if self._interfaces is None:
+                    self._interfaces = self._discoverInterfaces()
+        return self._interfaces
+
+
+    @_writer
     def addJob(self, job):
         '''
             Set job id, add it to dict and run it.
+            If worker agents are registered, the job (or every job
+            of MuxJob) is run by the least loaded agent.
             Raise self.ObjectError of job is run in context of uknown object.
         '''
 
-        job.id = 0 # set job id
+        job.id = self._next_jid # set job id
+        self._next_jid += 1
+
+        if self.agents is not None and self.agents.agents:
+            from .remote import RemoteJob
+            if hasattr(job, "jobs"):
+                for child in job.jobs:
+                    child.id = job.id
+                job.jobs = [RemoteJob(child, self.agents) for child in job.jobs]
+            else:
+                job = RemoteJob(job, self.agents)
+
         self.jobs[job.id] = job # add job to dict
+        self.governor.started(job, time.time())
 
         # Job being added already "knows" it's context, so we need to extract
         # it in order to track what jobs are run in what contexts.
@@ -46,14 +148,237 @@ class LocalHost:
         job.run()
 
 
+    @_writer
     def update(self):
         '''
             Communicate with all the jobs, gathering messages from them,
             updating network objects accroding to these messages
             and generating list of events that occured.
+            Messages of MuxJob carry "source" and "seq" tags (see MuxJob);
+            they are copied to every event caused by the message.
+        '''
+
+        if self.agents is not None:
+            self.agents.poll()
+
+        now = time.time()
+        events = [] # list of events
+        for job in list(self.jobs.values()):
+            messages = job.update() or []
+            for message in messages:
+                tags = {key: message[key] for key in ("source", "seq") if key in message}
+                for ev in self._apply(message):
+                    ev.update(tags)
+                    events.append(ev)
+            self.governor.observed(job, len(messages), now)
+
+        # Compact and evict finished jobs according to retention policy
+        self.governor.enforce(self.jobs, now)
+
+        # Mark hosts and ports that have gone quiet
+        for obj in self._wheel.advance(now):
+            events += self._expire(obj, now)
+        return events
+
+
+    def addAgent(self, address, token=None):
+        '''
+            Connect to worker agent at "host:port" address, presenting
+            given token. Jobs added from now on are run by agents
+            (see AgentPool). Connection is made without holding self.lock,
+            so an unresponsive agent does not hold back writers;
+            only registration of the connected agent is serialized.
+            Raise AgentPool.ConnectError if agent can not be connected.
+        '''
+        from .remote import AgentPool
+
+        if self.agents is not None and address in self.agents.agents:
+            return
+        agent = AgentPool.connect(address, token)
+        with self.lock:
+            if self.agents is None:
+                self.agents = AgentPool()
+            self.agents.register(agent)
+
+
+    @_writer
+    def dropAgent(self, address):
+        '''
+            Disconnect from worker agent. Its jobs are moved to other agents.
+            Raise KeyError if there is no such agent.
+        '''
+        if self.agents is None:
+            raise KeyError(address)
+        self.agents.remove(address)
+
+
+    @_writer
+    def setTtl(self, ttl, interface=None, kind=None):
+        '''
+            Set time to live (in seconds) of hosts and ports: when nothing
+            has been heard of an object for this long, its state becomes
+            self.EXPIRED_STATE. TTL of None disables expiry.
+            Interface is interface name, kind is "host", "tcp" or "udp";
+            None stands for all interfaces or kinds. The most specific
+            TTL applies. Affected hosts and ports are rescheduled at once,
+            so that quiet objects expire by the new TTL as well.
+        '''
+        self._ttls[(interface, kind)] = None if ttl is None else float(ttl)
+
+        for iface in list(self.interfaces.values()):
+            if interface not in (None, iface.name):
+                continue
+            for host in list(iface.hosts.values()):
+                if kind in (None, "host"):
+                    self._schedule(host)
+                if kind != "host":
+                    for port in host.allPorts():
+                        if kind in (None, port.proto):
+                            self._schedule(port)
+
+
+    @_writer
+    def addHost(self, iface, host):
+        '''
+            Add host to given interface and to indexes.
+            Raise self.ObjectError if interface does not belong
+            to this LocalHost.
+            Raise Interface.DuplicateError if interface already
+            has host with such ip address.
+        '''
+        if all(iface is not known for known in self.interfaces.values()):
+            raise self.ObjectError
+        iface.addHost(host)
+        self._index.add(host, iface)
+        self._schedule(host)
+        for port in host.allPorts():
+            self._index.add(port, host)
+            self._schedule(port)
+
+
+    @_writer
+    def dropHost(self, iface, host):
+        '''
+            Delete host from given interface and from indexes.
+            Raise Interface.ObjectError if host does not belong to interface.
+        '''
+        iface.dropHost(host)
+        for port in host.allPorts():
+            self._index.remove(port)
+            self._wheel.cancel(port)
+            self._expired.pop(port, None)
+        self._index.remove(host)
+        self._wheel.cancel(host)
+        self._expired.pop(host, None)
+
+
+    @_writer
+    def addPort(self, host, port):
         '''
+            Add port to given host and to indexes.
+            Raise self.ObjectError if host has been dropped
+            or does not belong to this LocalHost.
+            Raise Host.DuplicateError if such port already exists.
+        '''
+        if host not in self._index.parents:
+            raise self.ObjectError
+        host.addPort(port)
+        self._index.add(port, host)
+        self._schedule(port)
+
+
+    @_writer
+    def dropPort(self, host, port):
+        '''
+            Delete port from given host and from indexes.
+            Raise Host.ObjectError if port does not belong to host.
+        '''
+        host.dropPort(port)
+        self._index.remove(port)
+        self._wheel.cancel(port)
+        self._expired.pop(port, None)
+
+
+    @_writer
+    def load(self, iface, hosts):
+        '''
+            Merge hosts, built together with their ports, into given
+            interface in one go. Unknown hosts and ports are added as is.
+            Known ones take attributes of the loaded objects if those
+            were active more recently. No events are generated.
+        '''
+        for host in hosts:
+            known = iface.hosts.get(host.ip)
+            if known is None:
+                self.addHost(iface, host)
+                continue
+            if self._newer(host, known):
+                self.setAttrs(known, mac=host.mac, os=host.os, state=host.state,
+                              last_activity=host.last_activity)
+            for port in host.allPorts():
+                known_port = known.ports[port.proto].get(port.number)
+                if known_port is None:
+                    self.addPort(known, port)
+                elif self._newer(port, known_port):
+                    self.setAttrs(known_port, state=port.state,
+                                  last_activity=port.last_activity)
+
+
+    @_writer
+    def setAttrs(self, obj, **attrs):
+        '''
+            Assign attributes of Host or Port object, keeping indexes current.
+            Attributes that the object does not have are ignored.
+            If last_activity of an expired object moves forward and no
+            state is given, the object gets back its state before expiry
+            ("unknown" if it was loaded already expired).
+            Return list of events caused by the change: "state" event
+            if state changed and "changed" event if any other attribute
+            except last_activity changed.
+        '''
+
+        old = {attr: getattr(obj, attr) for attr in attrs
+               if hasattr(obj, attr) and attr not in ("ip", "number", "proto", "ports")}
+        new = {attr: attrs[attr] for attr in old if old[attr] != attrs[attr]}
 
-        return [] # list of events
+        # Fresh activity of expired object ends its expiry
+        seen = new.get("last_activity")
+        if "state" in old:
+            self._expired.pop(obj, None)
+        elif obj.state == self.EXPIRED_STATE and seen is not None \
+                and seen > (obj.last_activity or 0):
+            old["state"] = obj.state
+            new["state"] = self._expired.pop(obj, "unknown")
+
+        # Single dict update, so that readers never see half of the change
+        obj.__dict__.update(new)
+
+        events = []
+        changed = {}
+        for attr, value in new.items():
+            if obj in self._index.parents:
+                self._index.change(obj, attr, old[attr], value)
+                if attr == "last_activity":
+                    self._schedule(obj)
+            if attr == "state":
+                events.append({"type": "state", "object": obj,
+                               "old": old[attr], "new": value})
+            elif attr != "last_activity":
+                changed[attr] = value
+
+        if changed:
+            events.append({"type": "changed", "object": obj, "attrs": changed})
+        return events
+
+
+    def find(self, expr):
+        '''
+            Return generator of Host or Port objects matching query
+            expression (see Query for the language).
+            Raise Query.Error if expression is malformed.
+        '''
+        from .query import Query
+        return Query(expr).run(self._index)
 
 
     def jobsInContext(self, obj=None):
@@ -66,13 +391,15 @@ class LocalHost:
         return [] # list of jobs
 
 
+    @_writer
     def dropJob(self, job):
         '''
             Delete given job. The job being deleted should not be running.
         '''
         if job.isRunning():
             raise self.JobRunningError
-        # ...
+        self.jobs.pop(job.id, None)
+        self.governor.dropped(job)
 
 
     def findParents(self, obj):
@@ -81,6 +408,137 @@ class LocalHost:
                 0: Interface object
                 1: Host object
                 2: Port object
+            Raise self.ObjectError if given object does not belong
+            to this LocalHost.
+        '''
+
+        parents = [] # list of parent objects
+
+        # Chain is walked with get(), since objects may be dropped
+        # concurrently: if it is broken, it does not end at an interface
+        parent = self._index.parents.get(obj)
+        while parent is not None:
+            parents.insert(0, parent)
+            parent = self._index.parents.get(parent)
+        top = parents[0] if parents else obj
+        if all(top is not iface for iface in list(self.interfaces.values())):
+            raise self.ObjectError
+        return parents
+
+
+    @staticmethod
+    def _newer(obj, known):
+        '''
+            Return True if obj was active more recently than known object.
+        '''
+        if obj.last_activity is None:
+            return False
+        return known.last_activity is None or obj.last_activity > known.last_activity
+
+
+    def _ttl(self, obj):
+        '''
+            Return time to live of Host or Port object.
+        '''
+        kind = getattr(obj, "proto", "host")
+        iface = self.findParents(obj)[0].name
+        for key in [(iface, kind), (iface, None), (None, kind), (None, None)]:
+            if key in self._ttls:
+                return self._ttls[key]
+        return None
+
+
+    def _schedule(self, obj):
+        '''
+            Schedule expiry of object according to its last activity.
+        '''
+        ttl = self._ttl(obj)
+        if ttl is None or obj.last_activity is None:
+            self._wheel.cancel(obj)
+        else:
+            self._wheel.schedule(obj, obj.last_activity + ttl)
+
+
+    def _expire(self, obj, now):
+        '''
+            Handle expiry of object scheduled by the timing wheel.
+            Return list of events.
+        '''
+        ttl = self._ttl(obj)
+        if ttl is None:
+            return []
+
+        # TTL could have been raised since the object was scheduled
+        if obj.last_activity + ttl > now:
+            self._wheel.schedule(obj, obj.last_activity + ttl)
+            return []
+        if obj.state == self.EXPIRED_STATE:
+            return []
+        state = obj.state
+        events = self.setAttrs(obj, state=self.EXPIRED_STATE)
+        self._expired[obj] = state
+        return events
+
+
+    def _apply(self, message):
+        '''
+            Update network objects according to message produced by a job.
+            Message is a dict with the following keys:
+                type - "host" or "port"
+                interface - name of interface the host is behind
+                ip - ip address of the host
+                proto, number - transport protocol and port number
+                    (for "port" messages only)
+                attrs - dict of observed object attributes (optional)
+                time - timestamp of observation (optional, default is now)
+            Hosts and ports that are not known yet are created.
+            Return list of events.
+        '''
+        from .host import Host
+        from .port import Port
+
+        iface = self.interfaces.get(message.get("interface"))
+        if iface is None:
+            return []
+        seen = message.get("time") or time.time()
+        events = []
+
+        host = iface.hosts.get(message.get("ip"))
+        if host is None:
+            try:
+                host = Host(message.get("ip"))
+            except Host.IPError:
+                return []
+            self.addHost(iface, host)
+            events.append({"type": "added", "object": host})
+        obj = host
+
+        if message.get("type") == "port":
+            events += self.setAttrs(host, last_activity=seen)
+            proto, num = message.get("proto"), message.get("number")
+            obj = host.ports.get(proto, {}).get(num)
+            if obj is None:
+                try:
+                    obj = Port(num, proto)
+                except (Port.Error, TypeError):
+                    return events
+                self.addPort(host, obj)
+                events.append({"type": "added", "object": obj})
+
+        attrs = dict(message.get("attrs") or {})
+        attrs.setdefault("last_activity", seen)
+        return events + self.setAttrs(obj, **attrs)
+
+
+    def _discoverInterfaces(self):
+        '''
+            Return dict of all the network interfaces of this machine.
         '''
+        import socket
+        from .interface import Interface
 
-        return [] # list of parent objects
+        try:
+            names = [name for _, name in socket.if_nameindex()]
+        except OSError:
+            names = []
+        return {name: Interface(name) for name in names}
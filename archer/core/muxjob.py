@@ -1,50 +1,171 @@
+import collections
+
+from .job import Job
+
 
 class MuxJob:
     '''
         Continer class that multiplexes I/O from several jobs
         into one place. Intended use case is when the same job
         needs to be run in different contexts.
+        Output and events of the jobs are merged fairly: jobs are served
+        round-robin, and read() takes at most quota characters of every
+        job's output per call. Every line and event is tagged with the
+        context path of its job and a sequence number, that grows in
+        the order lines and events arrive from the jobs. LocalHost copies
+        the tags of an event to the inventory events it causes.
+        Backpressure: once output of MuxJob has been read, a job whose
+        unread output exceeds backlog characters is not updated (so its
+        stdout is not read) until the output is consumed. The job's pipe
+        then fills up and its process blocks. Until the first read()
+        nobody is assumed to be reading, and output is collected
+        without limit, so that the jobs run to completion.
     '''
 
-    def __init__(self, name, contexts):
+    BACKLOG = 64 << 10 # default limit of unread output per job
+    QUOTA = 4 << 10 # default characters of output per job per read()
+
+
+    def __init__(self, name, contexts, backlog=BACKLOG, quota=QUOTA):
         '''
             Initialize instance by creating the jobs.
+            Backlog of None disables backpressure.
             Raise Job.NameError if manifest for given job name is not found.
             Raise Job.ContextError if some contexts are inappropriate
             for this job.
         '''
 
         self.name = name # job name
-        self.jobs = [Job(name, cont) for cont in context] # muxed jobs
+        self.jobs = [Job(name, cont) for cont in contexts] # muxed jobs
         self.context = {} # the biggest common context
-        self.jid = None # assigned by LocalHost before running
+        self.id = None # assigned by LocalHost before running
+        self.backlog = backlog # limit of unread output per job
+        self.quota = quota # characters of output per job per read()
+        self._reading = False # True once output is read, enables backpressure
+
+        # Per-job merge state, in the order of self.jobs
+        self._streams = [_Stream(_contextPath(job.context)) for job in self.jobs]
+        self._seq = 0 # sequence number of the last tagged line or event
+        self._next = 0 # index of the job served first by the next read()
+
+
+    @property
+    def state(self):
+        '''
+            "running" if any job is running, "finished" otherwise.
+        '''
+        return "running" if self.isRunning() else "finished"
+
+
+    @property
+    def return_code(self):
+        '''
+            The first non-zero return code of the jobs, 0 if all of them
+            succeeded, None if some jobs are running or have no return code.
+        '''
+        codes = [job.return_code for job in self.jobs]
+        failed = [code for code in codes if code]
+        if failed:
+            return failed[0]
+        return None if None in codes or self.isRunning() else 0
 
 
     def run(self):
         '''
             Run all the jobs.
         '''
+        for job in self.jobs:
+            job.run()
 
 
     def update(self):
         '''
-            Update all the jobs and return list of events from them.
-            The order of returned events is undefined.
+            Update all the jobs that are not held back by backpressure,
+            collect their output and return list of their events.
+            Events are interleaved round-robin between the jobs; every
+            event gets "source" (context path) and "seq" keys.
         '''
 
+        batches = [] # lists of events, one per job
+        for job, stream in zip(self.jobs, self._streams):
+            if self._reading and self.backlog is not None \
+                    and stream.unread() >= self.backlog:
+                continue
+            events = job.update() or []
+            for ev in events:
+                ev["source"] = stream.path
+                ev["seq"] = self._tag()
+            batches.append(events)
+            self._collect(job, stream)
+
+        # Interleave: first events of every job, then second ones etc.
+        merged = []
+        for depth in range(max(map(len, batches), default=0)):
+            merged += [events[depth] for events in batches if depth < len(events)]
+        return merged
+
+
+    def readLines(self):
+        '''
+            Take output of the jobs collected by update(). Jobs are served
+            round-robin, starting with the one after the job served first
+            last time, and at most self.quota characters are taken from
+            each job (but at least one line, if it has any).
+            Return list of (seq, context path, line) tuples.
+            From now on backpressure applies (see MuxJob).
+        '''
+
+        self._reading = True
+        lines = []
+        count = len(self._streams)
+        for step in range(count):
+            stream = self._streams[(self._next + step) % count]
+            taken = 0
+            while stream.lines:
+                if taken and taken + len(stream.lines[0][1]) > self.quota:
+                    break
+                seq, line = stream.lines.popleft()
+                stream.size -= len(line)
+                taken += len(line)
+                lines.append((seq, stream.path, line))
+        if count:
+            self._next = (self._next + 1) % count
+        return lines
+
 
     def read(self):
         '''
-            Read stdout of all the jobs.
-            It is guaranteed that every line of returned text belongs to
-            a single job; however, the order of those lines is undefined.
+            Read stdout of all the jobs (see readLines). Every line of
+            returned text is prefixed with its sequence number and
+            the context path of its job, separated by tabs.
         '''
+        return _format(self.readLines())
+
+
+    def drain(self):
+        '''
+            Take all the output at once, ignoring quota: output collected
+            by update() and output the jobs still hold. Lines are returned
+            in the order they arrived, formatted as by read().
+            Used to keep the tail of output of a finished job.
+        '''
+        for job, stream in zip(self.jobs, self._streams):
+            self._collect(job, stream)
+        lines = []
+        for stream in self._streams:
+            lines += [(seq, stream.path, line) for seq, line in stream.lines]
+            stream.lines.clear()
+            stream.size = 0
+        lines.sort()
+        return _format(lines)
 
 
     def write(self, data):
         '''
             Write to stdin of all the jobs.
         '''
+        for job in self.jobs:
+            job.write(data)
 
 
     def signal(self, sig="term"):
@@ -52,9 +173,93 @@ class MuxJob:
             Send signal to all the jobs.
             Raise Job.SignalError if signal name is invalid.
         '''
+        for job in self.jobs:
+            job.signal(sig)
 
 
     def isRunning(self):
         '''
             Return True if any job is running.
         '''
+        return any(job.isRunning() for job in self.jobs)
+
+
+    def memoryUsage(self):
+        '''
+            Return approximate number of bytes taken by buffers of all the jobs,
+            including their output collected but not yet read.
+        '''
+        return (sum(job.memoryUsage() for job in self.jobs)
+                + sum(stream.unread() for stream in self._streams))
+
+
+    def _tag(self):
+        '''
+            Return the next sequence number.
+        '''
+        self._seq += 1
+        return self._seq
+
+
+    def _collect(self, job, stream):
+        '''
+            Move output of job to its stream, split into tagged lines.
+            Incomplete last line is kept until the rest of it arrives
+            or the job finishes.
+        '''
+        data = stream.partial + (job.read() or "")
+        lines = data.split("\n")
+        stream.partial = lines.pop()
+        if stream.partial and not job.isRunning():
+            lines.append(stream.partial)
+            stream.partial = ""
+        for line in lines:
+            line += "\n"
+            stream.lines.append((self._tag(), line))
+            stream.size += len(line)
+
+
+class _Stream:
+    '''
+        Output of one job of MuxJob that has not been read yet.
+    '''
+
+    __slots__ = ("path", "lines", "partial", "size")
+
+    def __init__(self, path):
+        self.path = path # context path of the job
+        self.lines = collections.deque() # (seq, line) tuples
+        self.partial = "" # incomplete last line
+        self.size = 0 # characters in lines
+
+
+    def unread(self):
+        '''
+            Return number of characters collected but not read yet.
+        '''
+        return self.size + len(self.partial)
+
+
+def _format(lines):
+    '''
+        Join (seq, context path, line) tuples into tab-separated text.
+    '''
+    return "".join("{}\t{}\t{}".format(seq, path, line)
+                   for seq, path, line in lines)
+
+
+def _contextPath(context):
+    '''
+        Return device path of job context, e.g. /eth0/10.0.0.1/tcp/22.
+    '''
+    iface, host, port = (context.get(key) for key in ("interface", "host", "port"))
+    names = []
+    if iface:
+        names.append(iface.name)
+    if host:
+        names.append(host.ip)
+    if port:
+        names += [port.proto, str(port.number)]
+    elif context.get("proto"):
+        names.append(context["proto"])
+    return "/" + "/".join(names)
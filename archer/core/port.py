@@ -31,7 +31,7 @@ class Port:
         if proto not in ("tcp", "udp"):
             raise self.ProtocolError
 
-        self.num = num # port number
+        self.number = num # port number
         self.proto = proto # transport-layer protocol
         self.last_activity = None # last activity timestamp
         self.state = "unknown" # current state
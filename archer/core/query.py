@@ -0,0 +1,286 @@
+import re
+import time
+
+from .. import util
+
+
+class Query:
+    '''
+        Class that represents parsed inventory query. Query language is
+        a conjunction of terms over Host or Port attributes:
+
+            hosts where tcp/22=open and os=linux
+            ports where state=filtered and seen<1h
+            ports where port=tcp/443 and ip in 10.0.0.0/8
+
+        The first word is a kind of objects to find ("hosts" or "ports"),
+        followed by optional "where" and terms joined by "and".
+        Term is <field> <op> <value>, where op is one of =, !=, <, <=,
+        >, >=, in. Values containing spaces should be double-quoted.
+        Fields of hosts: ip, mac, os, state, last_activity, seen, iface
+        and <proto>/<number> (state of the port of the host).
+        Fields of ports: proto, number, port (<proto>/<number>), state,
+        last_activity, seen, and ip, mac, os, iface of the port's host.
+        "seen" compares time passed since last activity, given in seconds
+        or with suffix s, m, h or d. "ip" accepts a network in CIDR notation
+        with "in" or "=" operators.
+    '''
+
+
+    # General case error. Error string is human-readable description
+    # of what is wrong with query.
+    class Error(Exception): pass
+
+
+    # Regular expressions for query tokens
+    _KIND = re.compile(r'\s*(hosts?|ports?)(?:\s+where\b)?\s*', re.I)
+    _TERM = re.compile(r'([\w/.:-]+)\s*(!=|<=|>=|=|<|>|\s+in\s+)\s*'
+                       r'("[^"]*"|[^\s"]+)\s*(?:$|\band\b\s*)', re.I)
+
+    # Duration suffixes for "seen" values, in seconds
+    _UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+    # Fields of port queries that belong to the port's host
+    _HOST_FIELDS = ("ip", "mac", "os", "iface")
+
+    _OPS = {
+        "=": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+    }
+
+
+    def __init__(self, expr):
+        '''
+            Parse query expression.
+            Raise self.Error if expression is malformed.
+        '''
+
+        match = self._KIND.match(expr)
+        if not match:
+            raise self.Error("query should start with 'hosts' or 'ports'")
+        self.kind = match.group(1).lower().rstrip("s") # "host" or "port"
+        self.terms = [] # list of (field, op, value) tuples
+
+        pos = match.end()
+        while pos < len(expr):
+            match = self._TERM.match(expr, pos)
+            if not match:
+                raise self.Error("can not parse term: {}".format(expr[pos:]))
+            field, op, value = match.groups()
+            self._addTerm(field.lower(), op.strip().lower(), value.strip('"'))
+            pos = match.end()
+
+
+    def run(self, index, now=None):
+        '''
+            Return generator of objects from given Index that match
+            the query. Candidates are taken from the most selective
+            indexed term, and checked against the rest of the terms.
+        '''
+
+        now = time.time() if now is None else now
+        plans = [plan for plan in (self._plan(term, index, now)
+                                   for term in self.terms) if plan]
+        if plans:
+            _, candidates = min(plans, key=lambda plan: plan[0])
+        else:
+            candidates = lambda: index.objects[self.kind]
+
+        # Take a copy of candidates, so that the index may change
+        # while results are being consumed. Objects dropped in the meantime
+        # are skipped.
+        for obj in list(candidates()):
+            try:
+                if all(self._match(obj, term, index, now) for term in self.terms):
+                    yield obj
+            except KeyError:
+                continue
+
+
+    def _addTerm(self, field, op, value):
+        '''
+            Validate term, convert its value and add it to self.terms.
+        '''
+
+        if field == "num":
+            field = "number"
+
+        # <proto>/<number> of port query is a pair of terms
+        if self.kind == "port" and field == "port":
+            if op != "=":
+                raise self.Error("port can only be compared with =")
+            proto, _, num = value.partition("/")
+            self._addTerm("proto", op, proto)
+            self._addTerm("number", op, num)
+            return
+
+        if op == "in" and field != "ip":
+            raise self.Error("'in' is only supported for ip")
+
+        if field == "ip":
+            net = self._parseNetwork(value)
+            if op in ("=", "in"):
+                field, op, value = "ip", "in", net
+            elif op == "!=":
+                field, op, value = "ip", "not in", net
+            else:
+                raise self.Error("ip can only be compared with =, != or in")
+
+        elif field == "seen":
+            # Time since last activity is converted to timestamp bound,
+            # so "seen < 1h" becomes "last_activity > now - 1h"
+            flip = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+            if op not in flip:
+                raise self.Error("seen can only be compared with <, <=, > or >=")
+            field, op, value = "seen", flip[op], self._parseDuration(value)
+
+        elif field in ("last_activity", "number"):
+            try:
+                value = float(value) if field == "last_activity" else int(value)
+            except ValueError:
+                raise self.Error("invalid {}: {}".format(field, value))
+
+        elif self.kind == "host" and "/" in field:
+            proto, _, num = field.partition("/")
+            if proto not in ("tcp", "udp") or not num.isdigit():
+                raise self.Error("invalid port: {}".format(field))
+            if op not in ("=", "!="):
+                raise self.Error("port state can only be compared with = or !=")
+            field = (proto, int(num))
+
+        elif field in ("proto", "state", "os", "mac", "iface"):
+            if op not in ("=", "!="):
+                raise self.Error("{} can only be compared with = or !=".format(field))
+            if field == "proto":
+                value = value.lower()
+
+        else:
+            raise self.Error("unknown field: {}".format(field))
+
+        if self.kind == "host" and field in ("proto", "number"):
+            raise self.Error("unknown host field: {}".format(field))
+        self.terms.append((field, op, value))
+
+
+    def _parseNetwork(self, value):
+        '''
+            Parse ip address or network in CIDR notation.
+            Return tuple (integer address, prefix length).
+        '''
+        addr, _, length = value.partition("/")
+        length = length or "32"
+        if not util.is_ip(addr) or not length.isdigit() or int(length) > 32:
+            raise self.Error("invalid network: {}".format(value))
+        return util.ip_to_int(addr), int(length)
+
+
+    def _parseDuration(self, value):
+        '''
+            Parse duration given in seconds or with unit suffix.
+        '''
+        unit = self._UNITS.get(value[-1:].lower())
+        try:
+            return float(value[:-1]) * unit if unit else float(value)
+        except ValueError:
+            raise self.Error("invalid duration: {}".format(value))
+
+
+    def _plan(self, term, index, now):
+        '''
+            Return tuple (estimated size, candidates function) if term
+            can be served by index, None otherwise.
+        '''
+
+        field, op, value = term
+        kind = self.kind
+
+        if op == "=" and field in index.values[kind]:
+            objs = index.values[kind][field].get(value, ())
+            return len(objs), lambda: objs
+
+        if field in ("last_activity", "seen") and op != "!=":
+            lo, hi = self._bounds(op, self._timestamp(term, now))
+            timeline = index.activity[kind]
+            return timeline.count(lo, hi), lambda: timeline.range(lo, hi)
+
+        if field == "ip" and op == "in":
+            count = index.countInNetwork(*value)
+            hosts = lambda: index.hostsInNetwork(*value)
+            if kind == "host":
+                return count, hosts
+            ratio = len(index.objects["port"]) / max(1, len(index.objects["host"]))
+            return (count * ratio,
+                    lambda: (port for host in hosts() for port in host.allPorts()))
+
+        if isinstance(field, tuple) and op == "=":
+            # Hosts having given port in given state: look through the
+            # smaller of "ports with this number" and "ports in this state"
+            proto, num = field
+            by_num = index.values["port"]["number"].get(num, ())
+            by_state = index.values["port"]["state"].get(value, ())
+            ports = min(by_num, by_state, key=len)
+            return len(ports), lambda: (
+                index.parents.get(port) for port in list(ports)
+                if port.proto == proto and port.number == num
+                and port.state == value and port in index.parents)
+
+        return None
+
+
+    def _match(self, obj, term, index, now):
+        '''
+            Return True if object satisfies term.
+        '''
+
+        field, op, value = term
+        if obj not in index.parents:
+            raise KeyError(obj)
+
+        # Fields of host that are queried for port
+        if self.kind == "port" and field in self._HOST_FIELDS:
+            obj = index.parents[obj]
+
+        if field == "ip":
+            addr, length = value
+            mask = (0xffffffff << (32 - length)) & 0xffffffff
+            inside = util.ip_to_int(obj.ip) & mask == addr & mask
+            return inside if op == "in" else not inside
+
+        if field == "iface":
+            return self._OPS[op](index.parents[obj].name, value)
+
+        if isinstance(field, tuple):
+            port = obj.ports[field[0]].get(field[1])
+            return self._OPS[op](port.state if port else None, value)
+
+        if field in ("last_activity", "seen"):
+            return self._OPS[op](obj.last_activity, self._timestamp(term, now))
+
+        return self._OPS[op](getattr(obj, field), value)
+
+
+    @staticmethod
+    def _timestamp(term, now):
+        '''
+            Return timestamp the time term compares last_activity with.
+        '''
+        field, _, value = term
+        return now - value if field == "seen" else value
+
+
+    @staticmethod
+    def _bounds(op, ts):
+        '''
+            Return (lo, hi) bounds for Timeline.range, that cover
+            all timestamps t satisfying "t op ts". The bounds may be
+            wider than needed: terms are checked again by _match.
+        '''
+        if op in ("<", "<="):
+            return None, ts + 1
+        if op in (">", ">="):
+            return ts, None
+        return ts, ts + 1
@@ -0,0 +1,431 @@
+import json
+import os
+import selectors
+import signal
+import socket
+import time
+
+
+class Channel:
+    '''
+        Non-blocking socket that exchanges newline-delimited JSON messages.
+        Used on both ends of controller-agent connection.
+    '''
+
+    def __init__(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+        self.closed = False # True when connection is lost
+        self._in = bytearray() # received data not yet split into messages
+        self._out = bytearray() # data waiting to be sent
+
+
+    def send(self, msg):
+        '''
+            Queue message for sending and send as much as possible now.
+        '''
+        if not self.closed:
+            self._out += (json.dumps(msg) + "\n").encode()
+            self.flush()
+
+
+    def flush(self):
+        '''
+            Send queued data while socket accepts it.
+            Return True if nothing is left to send.
+        '''
+        while self._out and not self.closed:
+            try:
+                sent = self.sock.send(self._out)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError:
+                self.close()
+                return False
+            del self._out[:sent]
+        return not self._out
+
+
+    def receive(self):
+        '''
+            Read all the data available now. Return list of received
+            messages. Mark channel closed if connection is lost.
+        '''
+        while not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                break
+            self._in += data
+
+        msgs = []
+        end = self._in.rfind(b"\n")
+        if end >= 0:
+            for line in bytes(self._in[:end]).split(b"\n"):
+                try:
+                    msgs.append(json.loads(line))
+                except ValueError:
+                    continue
+            del self._in[:end + 1]
+        return msgs
+
+
+    def pending(self):
+        '''
+            Return True if there is data waiting to be sent.
+        '''
+        return bool(self._out)
+
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def contextSpec(context):
+    '''
+        Convert job context (dict of Interface, Host, Port objects)
+        to JSON-ready dict of names: interface name, host ip,
+        transport protocol and port number.
+    '''
+    iface, host, port = (context.get(key) for key in ("interface", "host", "port"))
+    return {
+        "interface": iface.name if iface else None,
+        "host": host.ip if host else None,
+        "proto": port.proto if port else context.get("proto"),
+        "port": port.number if port else None
+    }
+
+
+class RemoteJob:
+    '''
+        Job that is run by an agent process instead of this one.
+        Has the same interface as Job. Output and events are delivered
+        by AgentPool.poll(); if the agent is lost, the job is started
+        again on another agent.
+    '''
+
+    def __init__(self, job, pool):
+        '''
+            Initialize remote counterpart of given (not yet run) Job.
+        '''
+        self.name = job.name # job manifest name
+        self.context = job.context # job context
+        self.id = job.id # job id, assigned by LocalHost
+        self.state = "init" # job state
+        self.return_code = None # job return code
+        self.spec = contextSpec(job.context) # context sent to agent
+        self.agent = None # _Agent that runs the job now
+        self.task = None # id of the job within AgentPool
+        self.attempts = 0 # number of times the job has been started
+        self._pool = pool
+        self._output = [] # received output chunks
+        self._events = [] # received events
+
+
+    def run(self):
+        '''
+            Place the job on the least loaded agent.
+        '''
+        self.state = "running"
+        self._pool.place(self)
+
+
+    def update(self):
+        '''
+            Return list of events received since the last call.
+        '''
+        events, self._events = self._events, []
+        return events
+
+
+    def read(self):
+        '''
+            Return output received since the last call.
+        '''
+        data = "".join(self._output)
+        self._output = []
+        return data
+
+
+    def write(self, data):
+        '''
+            Write to stdin of the job.
+        '''
+        if self.agent:
+            self.agent.channel.send({"op": "write", "task": self.task, "data": data})
+
+
+    def signal(self, sig="term"):
+        '''
+            Send signal to the job.
+            Raise Job.SignalError if signal name is invalid.
+        '''
+        from .job import Job
+
+        if not hasattr(signal, "SIG" + sig.upper()):
+            raise Job.SignalError
+        if self.agent:
+            self.agent.channel.send({"op": "signal", "task": self.task, "sig": sig})
+        elif self.state == "running" and sig in ("term", "kill", "int"):
+            # Job is waiting for an agent, so there is no process to signal
+            self._pool.forget(self)
+            self.state = "killed"
+
+
+    def isRunning(self):
+        '''
+            Return True if job is running (or waiting for an agent).
+        '''
+        return self.state == "running"
+
+
+    def memoryUsage(self):
+        '''
+            Return approximate number of bytes taken by received
+            output and events.
+        '''
+        return sum(map(len, self._output)) + 128 * len(self._events)
+
+
+class _Agent:
+    '''
+        Connection to an agent process, as seen by AgentPool.
+    '''
+
+    def __init__(self, address, channel, capacity):
+        self.address = address # "host:port" string
+        self.channel = channel # Channel to the agent
+        self.capacity = capacity # number of jobs the agent runs at full speed
+        self.load = 0.0 # system load reported by the agent, per cpu
+        self.jobs = {} # keys are task ids, values - RemoteJob objects
+        self.last_seen = time.time() # time of the last message
+
+
+    def score(self):
+        '''
+            Return placement score: the lower, the better.
+        '''
+        return (len(self.jobs) + 1) / self.capacity + self.load
+
+
+class AgentPool:
+    '''
+        Set of connections to worker agents (see archer.agent). Places
+        RemoteJob objects on agents with the lowest load and re-dispatches
+        jobs of agents that are lost. Jobs that can not be placed because
+        there are no agents wait until an agent is added.
+    '''
+
+
+    # General case error
+    class Error(Exception): pass
+
+    # Exception that is raised if agent can not be connected
+    class ConnectError(Error): pass
+
+
+    TIMEOUT = 10.0 # seconds of silence after which agent is considered lost
+    MAX_ATTEMPTS = 3 # number of times a job is started before giving up
+
+    # Lines added to output of a job whose agent is lost. Output of
+    # a restarted job repeats from the start, after the marker.
+    RESTARTED = "*** agent {} lost, restarting job (attempt {}) ***\n"
+    FAILED = "*** agent {} lost, job failed after {} attempts ***\n"
+
+
+    def __init__(self):
+        self.agents = {} # keys are "host:port" strings, values - _Agent objects
+        self._pending = [] # jobs waiting for an agent
+        self._selector = selectors.DefaultSelector()
+        self._next_task = 1 # id of the next placed job
+
+
+    def add(self, address, token=None):
+        '''
+            Connect to agent at "host:port" address and register it
+            (see connect and register).
+            Raise self.ConnectError if it fails.
+        '''
+        if address not in self.agents:
+            self.register(self.connect(address, token))
+
+
+    @classmethod
+    def connect(cls, address, token=None):
+        '''
+            Connect to agent at "host:port" address and present
+            the token it requires (ARCHER_AGENT_TOKEN by default).
+            Return _Agent object to be passed to register. Blocks for
+            up to a few seconds, and touches no state of the pool,
+            so it may be called without holding the caller's locks.
+            Raise cls.ConnectError if it fails.
+        '''
+        if token is None:
+            token = os.environ.get("ARCHER_AGENT_TOKEN") or ""
+        host, _, port = address.rpartition(":")
+        sock = None
+        try:
+            sock = socket.create_connection((host, int(port)), timeout=5)
+            capacity = int(json.loads(_readLine(sock))["capacity"])
+            sock.sendall((json.dumps({"op": "auth", "token": token}) + "\n").encode())
+            reply = json.loads(_readLine(sock))
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            if sock is not None:
+                sock.close()
+            raise cls.ConnectError(str(exc))
+        if reply != {"op": "ready"}:
+            sock.close()
+            raise cls.ConnectError("agent denied the token")
+        return _Agent(address, Channel(sock), max(1, capacity))
+
+
+    def register(self, agent):
+        '''
+            Add agent connected by connect() to the pool and place
+            jobs that wait for an agent. If an agent with the same
+            address is registered already, the new connection is closed.
+        '''
+        if agent.address in self.agents:
+            agent.channel.close()
+            return
+        agent.last_seen = time.time()
+        self.agents[agent.address] = agent
+        self._selector.register(agent.channel.sock, selectors.EVENT_READ, agent)
+        self._dispatchPending()
+
+
+    def remove(self, address):
+        '''
+            Disconnect from agent. Its jobs are placed on other agents.
+            Raise KeyError if there is no agent with such address.
+        '''
+        self._lost(self.agents[address])
+
+
+    def place(self, job):
+        '''
+            Start job on the agent with the lowest load.
+        '''
+        if not self.agents:
+            self._pending.append(job)
+            return
+        agent = min(self.agents.values(), key=lambda agent: agent.score())
+        job.agent = agent
+        job.task = self._next_task
+        job.attempts += 1
+        self._next_task += 1
+        agent.jobs[job.task] = job
+        agent.channel.send({"op": "run", "task": job.task,
+                            "name": job.name, "context": job.spec})
+
+
+    def forget(self, job):
+        '''
+            Remove job that is waiting for an agent.
+        '''
+        if job in self._pending:
+            self._pending.remove(job)
+
+
+    def poll(self):
+        '''
+            Exchange messages with all the agents without blocking,
+            updating jobs they run. Handle lost agents.
+        '''
+        for key, mask in self._selector.select(0):
+            agent = key.data
+            if mask & selectors.EVENT_READ:
+                for msg in agent.channel.receive():
+                    self._handle(agent, msg)
+            if mask & selectors.EVENT_WRITE:
+                agent.channel.flush()
+
+        now = time.time()
+        for agent in list(self.agents.values()):
+            if agent.channel.closed or now - agent.last_seen > self.TIMEOUT:
+                self._lost(agent)
+                continue
+            events = selectors.EVENT_READ
+            if agent.channel.pending():
+                events |= selectors.EVENT_WRITE
+            self._selector.modify(agent.channel.sock, events, agent)
+
+        self._dispatchPending()
+
+
+    def _handle(self, agent, msg):
+        '''
+            Handle message received from agent.
+        '''
+        agent.last_seen = time.time()
+        op = msg.get("op")
+        if op == "load":
+            agent.load = float(msg.get("load") or 0.0)
+            return
+
+        job = agent.jobs.get(msg.get("task"))
+        if job is None:
+            return
+        if op == "output":
+            job._output.append(msg.get("data") or "")
+        elif op == "events":
+            job._events += msg.get("events") or []
+        elif op == "exit":
+            del agent.jobs[job.task]
+            job.agent = None
+            job.return_code = msg.get("code")
+            job.state = msg.get("state") or "finished"
+
+
+    def _lost(self, agent):
+        '''
+            Drop agent and place its unfinished jobs elsewhere.
+        '''
+        del self.agents[agent.address]
+        try:
+            self._selector.unregister(agent.channel.sock)
+        except (KeyError, ValueError):
+            pass
+        agent.channel.close()
+        for job in agent.jobs.values():
+            job.agent = None
+            if job.attempts >= self.MAX_ATTEMPTS:
+                job._output.append(self.FAILED.format(agent.address, job.attempts))
+                job.state = "failed"
+            else:
+                job._output.append(self.RESTARTED.format(agent.address, job.attempts + 1))
+                self.place(job)
+
+
+    def _dispatchPending(self):
+        '''
+            Place jobs that wait for an agent, if there are agents now.
+        '''
+        if self.agents and self._pending:
+            pending, self._pending = self._pending, []
+            for job in pending:
+                self.place(job)
+
+
+def _readLine(sock):
+    '''
+        Read one line from blocking socket. Data is read byte by byte,
+        so that nothing that follows the line is consumed before
+        the socket is handed to Channel.
+    '''
+    line = b""
+    while not line.endswith(b"\n"):
+        byte = sock.recv(1)
+        if not byte:
+            raise OSError("connection closed by agent")
+        line += byte
+    return line
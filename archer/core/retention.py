@@ -0,0 +1,179 @@
+import collections
+
+from .muxjob import _contextPath
+
+
+class RetentionPolicy:
+    '''
+        Limits on finished jobs kept by LocalHost. Finished jobs beyond
+        max_jobs, or beyond max_bytes of buffered output in total, are
+        compacted into JobSummary objects (oldest first). Finished jobs
+        and summaries older than max_age seconds are evicted, as well as
+        the oldest summaries beyond max_summaries. None disables a limit.
+    '''
+
+    def __init__(self, max_jobs=100, max_bytes=32 << 20, max_age=7 * 86400,
+                 max_summaries=10000, tail=1024):
+        self.max_jobs = max_jobs # finished jobs kept in full
+        self.max_bytes = max_bytes # total buffered output of finished jobs
+        self.max_age = max_age # seconds a finished job is kept at all
+        self.max_summaries = max_summaries # compacted jobs kept
+        self.tail = tail # characters of output kept in a summary
+
+
+class JobSummary:
+    '''
+        Compact replacement of a finished job: keeps its return code,
+        number of events, timings and the tail of its unread output.
+        Has the interface of a finished Job, except that its context
+        is kept as device path, so deleted network objects are not
+        held by summaries.
+    '''
+
+    # Approximate memory taken by summary itself, besides output tail
+    OVERHEAD = 512
+
+
+    def __init__(self, job, stats, tail):
+        '''
+            Build summary of finished job with given stats (see Governor).
+            All the unread output of the job is consumed (MuxJob output
+            is drained past its per-read quota); at most tail characters
+            of it are kept.
+        '''
+        self.name = job.name # job manifest name
+        self.path = _contextPath(job.context) # device path of job context
+        self.id = job.id # job id
+        self.state = job.state # state the job finished in
+        self.return_code = job.return_code # job return code
+        self.started = stats["started"] # time the job was added
+        self.finished = stats["finished"] # time the job was seen finished
+        self.events = stats["events"] # number of events the job produced
+        output = (job.drain() if hasattr(job, "drain") else job.read()) or ""
+        self.truncated = len(output) > tail # True if output was cut
+        self.tail = output[-tail:] if tail else "" # end of unread output
+
+
+    def update(self):
+        return []
+
+
+    def read(self):
+        '''
+            Return the kept tail of output. Like Job.read, it is returned once.
+        '''
+        tail, self.tail = self.tail, ""
+        return tail
+
+
+    def write(self, data):
+        pass
+
+
+    def signal(self, sig="term"):
+        pass
+
+
+    def isRunning(self):
+        return False
+
+
+    def memoryUsage(self):
+        return self.OVERHEAD + len(self.tail)
+
+
+class Governor:
+    '''
+        Keeps memory taken by jobs of LocalHost bounded according to
+        RetentionPolicy. LocalHost reports jobs that are started,
+        updated and dropped; enforce() compacts and evicts finished jobs.
+        Cost of enforce() depends on the number of finished jobs kept
+        in full, not on the number of jobs ever run.
+    '''
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetentionPolicy() # current policy
+        self.stats = {} # keys are job ids, values - dicts of job stats
+        self._finished = collections.OrderedDict() # jid -> finish time, full jobs
+        self._summaries = collections.OrderedDict() # jid -> finish time, summaries
+
+
+    def started(self, job, now):
+        '''
+            Start tracking job that has just been added.
+        '''
+        self.stats[job.id] = {"started": now, "finished": None, "events": 0}
+
+
+    def observed(self, job, events, now):
+        '''
+            Account given number of events produced by job
+            and notice if it has finished.
+        '''
+        stats = self.stats.get(job.id)
+        if stats is None or stats["finished"] is not None:
+            return
+        stats["events"] += events
+        if not job.isRunning():
+            stats["finished"] = now
+            self._finished[job.id] = now
+
+
+    def dropped(self, job):
+        '''
+            Stop tracking job that has been deleted.
+        '''
+        self.stats.pop(job.id, None)
+        self._finished.pop(job.id, None)
+        self._summaries.pop(job.id, None)
+
+
+    def enforce(self, jobs, now):
+        '''
+            Apply policy to dict of jobs (keys are job ids): replace
+            finished jobs with summaries and delete old ones.
+        '''
+        policy = self.policy
+
+        # Evict whatever is too old or beyond the number of summaries
+        for done in (self._finished, self._summaries):
+            while done and policy.max_age is not None and \
+                    next(iter(done.values())) < now - policy.max_age:
+                self._evict(jobs, done)
+        while policy.max_summaries is not None and \
+                len(self._summaries) > policy.max_summaries:
+            self._evict(jobs, self._summaries)
+
+        # Compact the oldest finished jobs until they fit in limits
+        total = sum(jobs[jid].memoryUsage() for jid in self._finished)
+        while self._finished and (
+                (policy.max_jobs is not None and len(self._finished) > policy.max_jobs)
+                or (policy.max_bytes is not None and total > policy.max_bytes)):
+            jid, finished = self._finished.popitem(last=False)
+            job = jobs[jid]
+            total -= job.memoryUsage()
+            jobs[jid] = JobSummary(job, self.stats[jid], policy.tail)
+            self._summaries[jid] = finished
+
+
+    def usage(self, jobs):
+        '''
+            Return memory accounting of given dict of jobs.
+        '''
+        per_job = {jid: job.memoryUsage() for jid, job in list(jobs.items())}
+        return {
+            "total": sum(per_job.values()),
+            "finished": len(self._finished),
+            "summaries": len(self._summaries),
+            "running": len(per_job) - len(self._finished) - len(self._summaries),
+            "jobs": per_job
+        }
+
+
+    def _evict(self, jobs, done):
+        '''
+            Delete the oldest job of given ordered dict.
+        '''
+        jid, _ = done.popitem(last=False)
+        jobs.pop(jid, None)
+        self.stats.pop(jid, None)
@@ -0,0 +1,157 @@
+class TimingWheel:
+    '''
+        Hierarchical timing wheel. Schedules objects to expire at given
+        time and returns them when the time comes. Scheduling, rescheduling
+        and cancelling are O(1); advancing costs O(expired objects) plus
+        the objects that move to a lower level of the wheel, while periods
+        with nothing scheduled are skipped at once.
+        Every level has 2**bits slots. A slot of level 0 spans one tick
+        (resolution seconds), a slot of level n spans 2**(bits*n) ticks.
+        Deadlines beyond the top level are parked there and moved down
+        when they come within its reach.
+    '''
+
+
+    def __init__(self, now, resolution=1.0, levels=4, bits=6):
+        '''
+            Initialize empty wheel whose current time is now.
+        '''
+
+        self.resolution = resolution # length of one tick in seconds
+        self._bits = bits # log2 of number of slots per level
+        self._size = 1 << bits # number of slots per level
+        self._tick = self._toTick(now) # current tick
+        self._slots = [[set() for _ in range(self._size)] for _ in range(levels)]
+        self._counts = [0] * levels # number of objects on every level
+        self._where = {} # keys are objects, values - (level, slot)
+        self._deadlines = {} # keys are objects, values - deadline ticks
+        self._due = {} # objects scheduled in the past, expired at next advance
+
+
+    def __len__(self):
+        return len(self._deadlines)
+
+
+    def __contains__(self, obj):
+        return obj in self._deadlines
+
+
+    def schedule(self, obj, deadline):
+        '''
+            Schedule object to expire at deadline (timestamp in seconds).
+            If object is already scheduled, its deadline is replaced.
+        '''
+        self.cancel(obj)
+        tick = self._toTick(deadline)
+        self._deadlines[obj] = tick
+        if tick <= self._tick:
+            self._due[obj] = None
+        else:
+            self._place(obj, tick)
+
+
+    def cancel(self, obj):
+        '''
+            Cancel expiration of object. Do nothing if it is not scheduled.
+        '''
+        if self._deadlines.pop(obj, None) is None:
+            return
+        where = self._where.pop(obj, None)
+        if where is None:
+            del self._due[obj]
+        else:
+            level, slot = where
+            self._slots[level][slot].discard(obj)
+            self._counts[level] -= 1
+
+
+    def advance(self, now):
+        '''
+            Move wheel time forward to now.
+            Return list of objects whose deadline has come.
+        '''
+
+        expired = list(self._due)
+        self._due = {}
+        for obj in expired:
+            del self._deadlines[obj]
+
+        target = self._toTick(now)
+        while self._tick < target:
+
+            # Nothing scheduled - jump straight to the target
+            if not self._where:
+                self._tick = target
+                break
+
+            # If lower levels are empty, nothing can happen before
+            # the next slot boundary of the lowest non-empty level
+            level = next(n for n, count in enumerate(self._counts) if count)
+            if level:
+                span = 1 << (self._bits * level)
+                boundary = (self._tick // span + 1) * span
+                self._tick = min(target, boundary) - 1
+
+            self._tick += 1
+            self._cascade()
+            slot = self._slots[0][self._tick % self._size]
+            for obj in slot:
+                del self._where[obj]
+                del self._deadlines[obj]
+            self._counts[0] -= len(slot)
+            expired += slot
+            slot.clear()
+
+        return expired
+
+
+    def _toTick(self, ts):
+        '''
+            Convert timestamp to tick number, rounding up.
+        '''
+        return -int(-ts // self.resolution)
+
+
+    def _place(self, obj, tick):
+        '''
+            Put object to the slot that covers given tick.
+        '''
+        delta = tick - self._tick
+        levels = len(self._slots)
+        level = 0
+        while level < levels - 1 and delta >= 1 << (self._bits * (level + 1)):
+            level += 1
+
+        # Deadlines out of reach are parked at the last slot the top level
+        # reaches, and re-placed when that slot is cascaded
+        reach = 1 << (self._bits * levels)
+        if delta >= reach:
+            tick = self._tick + reach - 1
+
+        slot = (tick >> (self._bits * level)) % self._size
+        self._slots[level][slot].add(obj)
+        self._counts[level] += 1
+        self._where[obj] = (level, slot)
+
+
+    def _cascade(self):
+        '''
+            When current tick crosses slot boundary of upper levels,
+            move objects from those slots to lower levels.
+        '''
+        for level in range(1, len(self._slots)):
+            if self._tick % (1 << (self._bits * level)):
+                break
+            slot = self._slots[level][(self._tick >> (self._bits * level)) % self._size]
+            objs = list(slot)
+            slot.clear()
+            self._counts[level] -= len(objs)
+            for obj in objs:
+                del self._where[obj]
+                tick = self._deadlines[obj]
+                if tick <= self._tick:
+                    # Place to the current slot of level 0, which is
+                    # expired right after cascading
+                    self._place(obj, self._tick)
+                else:
+                    self._place(obj, tick)
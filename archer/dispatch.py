@@ -0,0 +1,341 @@
+'''
+    Delivery of controller events to subscribers. Subscriptions are
+    stored in a trie keyed by device path components, so that the cost
+    of dispatching an event grows with the number of subscribers that
+    match it rather than with the total number of subscribers.
+'''
+
+import collections
+import queue
+import threading
+
+from . import util
+
+
+class Subscription:
+    '''
+        Class that represents a single subscription: a device path prefix,
+        a set of event types and a target the events are delivered to.
+        Target is either a callable, that is called with every event, or
+        a queue.Queue-like object with put_nowait method.
+        Undelivered events are held in the subscription backlog, where
+        an event replaces the undelivered one with the same device and
+        type (coalescing). If the backlog grows beyond its limit, the oldest
+        events are dropped. Events of a queue wait in backlog while
+        the queue is full. A callable is called by the delivery thread
+        of the subscription, so a slow callable delays only its own
+        events; while it is busy, its events wait in backlog.
+        Exceptions raised by the target are counted, not propagated.
+    '''
+
+    def __init__(self, sid, prefix, types, target, backlog):
+        self.id = sid # subscription id
+        self.prefix = prefix # normalized path prefix
+        self.types = types # frozenset of event types, None for all types
+        self.target = target # callable or queue-like object
+        self.limit = backlog # maximum length of backlog
+        self.backlog = collections.OrderedDict() # undelivered events
+        self.coalesced = 0 # number of events replaced by newer ones
+        self.dropped = 0 # number of events dropped due to backlog limit
+        self.errors = 0 # number of events whose delivery raised an exception
+        self.active = True # False once the subscription is cancelled
+        self._cond = threading.Condition() # guards backlog and counters
+        self._thread = None # delivery thread of callable target
+
+
+    def deliver(self, ev):
+        '''
+            Deliver event to target, or keep it in backlog
+            if target can not accept it now.
+        '''
+        with self._cond:
+            if not self.active:
+                return
+            if not hasattr(self.target, "put_nowait"):
+                self._hold(ev)
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, daemon=True,
+                        name="archer-subscription-{}".format(self.id))
+                    self._thread.start()
+                self._cond.notify()
+                return
+
+            # Events are delivered in order, so if something is already
+            # waiting, the new event has to wait as well
+            if self.backlog and not self._flush():
+                self._hold(ev)
+                return
+            try:
+                self.target.put_nowait(ev)
+            except queue.Full:
+                self._hold(ev)
+
+
+    def flush(self):
+        '''
+            Move as many backlog events to queue target as it accepts.
+            Return True if backlog is empty afterwards.
+            Backlog of callable target is delivered by its thread.
+        '''
+        with self._cond:
+            if not hasattr(self.target, "put_nowait"):
+                return not self.backlog
+            return self._flush()
+
+
+    def close(self):
+        '''
+            Cancel subscription: undelivered events are discarded
+            and delivery thread stops.
+        '''
+        with self._cond:
+            self.active = False
+            self.backlog.clear()
+            self._cond.notify()
+
+
+    def _flush(self):
+        while self.backlog:
+            key, ev = next(iter(self.backlog.items()))
+            try:
+                self.target.put_nowait(ev)
+            except queue.Full:
+                return False
+            del self.backlog[key]
+        return True
+
+
+    def _run(self):
+        '''
+            Delivery thread of callable target.
+        '''
+        while True:
+            with self._cond:
+                while self.active and not self.backlog:
+                    self._cond.wait()
+                if not self.active:
+                    return
+                _, ev = self.backlog.popitem(last=False)
+            try:
+                self.target(ev)
+            except Exception:
+                with self._cond:
+                    self.errors += 1
+
+
+    def _hold(self, ev):
+        '''
+            Put event to backlog, coalescing it with the previous
+            undelivered event of the same device and type.
+        '''
+        key = (ev.get("device"), ev.get("type"))
+        if key in self.backlog:
+            del self.backlog[key]
+            self.coalesced += 1
+        self.backlog[key] = ev
+        while len(self.backlog) > self.limit:
+            self.backlog.popitem(last=False)
+            self.dropped += 1
+
+
+class Dispatcher:
+    '''
+        Path-prefix trie of subscriptions. Path components are interface
+        name, host ip address, transport protocol and port number.
+        Host component of a prefix may be a network in CIDR notation
+        (e.g. /eth0/10.0.0.0/24), that matches every host within it.
+        Dispatcher methods may be called from different threads.
+    '''
+
+    # General case error
+    class Error(Exception): pass
+
+    # Exception that is raised if subscription path is malformed
+    class PathError(Error): pass
+
+
+    def __init__(self):
+        self._root = _Node() # root of the trie
+        self._subs = {} # keys are subscription ids, values - (Subscription, node)
+        self._next_id = 1 # id of the next subscription
+        self._lock = threading.RLock() # guards the trie and subscriptions
+
+
+    def subscribe(self, path, types, target, backlog=1000):
+        '''
+            Register target for events of given types (None for all types)
+            of devices under given path. Return Subscription object.
+            Raise self.PathError if path is malformed.
+        '''
+        comps, net = self._parse(path)
+        if isinstance(types, str):
+            types = [types]
+        types = frozenset(types) if types is not None else None
+        if not (callable(target) or hasattr(target, "put_nowait")):
+            raise TypeError("target should be callable or have put_nowait")
+
+        with self._lock:
+            # Walk down the trie creating missing nodes
+            node = self._root
+            for depth, comp in enumerate(comps):
+                if depth == 1 and net is not None:
+                    nets = node.nets.setdefault(net[1], {})
+                    node = nets.setdefault(net[0], _Node())
+                else:
+                    node = node.children.setdefault(comp, _Node())
+
+            names = list(comps)
+            if net is not None:
+                names[1] = "{}/{}".format(util.int_to_ip(net[0]), net[1])
+            sub = Subscription(self._next_id, "/" + "/".join(names),
+                               types, target, backlog)
+            self._next_id += 1
+            for key in (types if types is not None else [None]):
+                node.subs.setdefault(key, []).append(sub)
+            self._subs[sub.id] = (sub, node)
+            return sub
+
+
+    def unsubscribe(self, sid):
+        '''
+            Remove subscription with given id.
+            Raise KeyError if there is no such subscription.
+        '''
+        with self._lock:
+            sub, node = self._subs.pop(sid)
+            for key in (sub.types if sub.types is not None else [None]):
+                node.subs[key].remove(sub)
+                if not node.subs[key]:
+                    del node.subs[key]
+        sub.close()
+
+
+    def get(self, sid):
+        '''
+            Return subscription with given id.
+            Raise KeyError if there is no such subscription.
+        '''
+        with self._lock:
+            return self._subs[sid][0]
+
+
+    def dispatch(self, ev):
+        '''
+            Deliver event to all matching subscriptions.
+            Event is matched by its "device" path and "type".
+            Subscriptions are matched under the lock and served
+            outside of it, so targets may subscribe and unsubscribe.
+        '''
+        if not self._subs:
+            return
+        with self._lock:
+            comps = [c for c in (ev.get("device") or "/").strip("/").split("/") if c]
+            evtype = ev.get("type")
+            keys = (None,) if evtype is None else (None, evtype)
+            subs = [sub for node in self._match(comps) for key in keys
+                    for sub in node.subs.get(key, ())]
+        for sub in subs:
+            try:
+                sub.deliver(ev)
+            except Exception:
+                sub.errors += 1
+
+
+    def flush(self):
+        '''
+            Try to deliver backlogs of all the subscriptions.
+        '''
+        with self._lock:
+            subs = [sub for sub, _ in self._subs.values() if sub.backlog]
+        for sub in subs:
+            try:
+                sub.flush()
+            except Exception:
+                sub.errors += 1
+
+
+    def _match(self, comps):
+        '''
+            Return list of trie nodes whose prefix matches
+            given path components.
+        '''
+        matched = [self._root]
+        frontier = [self._root]
+        for depth, comp in enumerate(comps):
+            step = []
+            for node in frontier:
+                child = node.children.get(comp)
+                if child is not None:
+                    step.append(child)
+                if depth == 1 and node.nets and util.is_ip(comp):
+                    addr = util.ip_to_int(comp)
+                    for length, nets in node.nets.items():
+                        child = nets.get(addr & _mask(length))
+                        if child is not None:
+                            step.append(child)
+            if not step:
+                break
+            matched += step
+            frontier = step
+        return matched
+
+
+    def _parse(self, path):
+        '''
+            Split subscription path into components. Return tuple
+            (components, net), where net is (network, prefix length)
+            if host is given in CIDR notation, None otherwise.
+            Raise self.PathError if path is malformed.
+        '''
+        comps = [c for c in path.strip("/").split("/") if c]
+        net = None
+
+        # Host may be followed by network prefix length
+        if len(comps) >= 3 and _isNumber(comps[2]):
+            length = int(comps.pop(2))
+            if not 0 <= length <= 32:
+                raise self.PathError("invalid prefix length: {}".format(length))
+            if length < 32:
+                if not util.is_ip(comps[1]):
+                    raise self.PathError("invalid network: {}".format(comps[1]))
+                net = (util.ip_to_int(comps[1]) & _mask(length), length)
+
+        if len(comps) > 4:
+            raise self.PathError("junk path component: {}".format(comps[4]))
+        if len(comps) >= 2 and not util.is_ip(comps[1]):
+            raise self.PathError("invalid ip address: {}".format(comps[1]))
+        if len(comps) >= 3:
+            comps[2] = comps[2].lower()
+            if comps[2] not in ("tcp", "udp"):
+                raise self.PathError("unknown transport proto: {}".format(comps[2]))
+        if len(comps) >= 4 and not _isNumber(comps[3]):
+            raise self.PathError("invalid port number: {}".format(comps[3]))
+        return comps, net
+
+
+class _Node:
+    '''
+        Node of subscription trie.
+    '''
+
+    __slots__ = ("children", "nets", "subs")
+
+    def __init__(self):
+        self.children = {} # keys are path components, values - child nodes
+        self.nets = {} # keys are prefix lengths, values - {network: child node}
+        self.subs = {} # keys are event types (None for any), values - subscriptions
+
+
+def _mask(length):
+    '''
+        Return integer network mask of given prefix length.
+    '''
+    return (0xffffffff << (32 - length)) & 0xffffffff
+
+
+def _isNumber(comp):
+    '''
+        Return True if path component is a decimal number of ASCII digits.
+    '''
+    return comp.isascii() and comp.isdigit()
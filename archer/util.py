@@ -12,3 +12,22 @@ def is_ip(string):
     except ValueError:
         return False
     return len(nums) == 4 and all(0 <= n < 256 for n in nums)
+
+
+def ip_to_int(string):
+    '''
+        Convert dotted ip address string to integer.
+        The string should be a valid ip address (see is_ip).
+    '''
+    a, b, c, d = (int(s) for s in string.split("."))
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def int_to_ip(num):
+    '''
+        Convert integer to dotted ip address string.
+        Raise ValueError if number is out of range of ip addresses.
+    '''
+    if not 0 <= num <= 0xffffffff:
+        raise ValueError("ip address out of range: {}".format(num))
+    return ".".join(str((num >> shift) & 0xff) for shift in (24, 16, 8, 0))
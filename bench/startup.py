@@ -0,0 +1,78 @@
+'''
+    Startup benchmark: measures wall time of one-shot controller runs,
+    i.e. a fresh interpreter that imports archer, creates Controller
+    and executes a single command. Target is well under 100 ms.
+
+    Usage: python bench/startup.py [runs]
+'''
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Target wall time of a single-command run, in seconds
+TARGET = 0.1
+
+# Keys are benchmark names, values are commands executed by the child
+COMMANDS = {
+    "jobs": "c.jobs()",
+    "stat /": "c.stat()",
+    "list /": "c.list()",
+    "stat /<iface>": "c.stat('/' + c.list()[0])",
+}
+
+SCRIPT = "from archer.controller import Controller; c = Controller(); {}"
+
+
+def measure(code, runs):
+    '''
+        Run code in fresh interpreter given number of times.
+        Return list of wall times in seconds.
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", SCRIPT.format(code)],
+                       cwd=root, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def baseline(runs):
+    '''
+        Return median wall time of a bare interpreter start,
+        the floor that no archer command can go below.
+    '''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    floor = baseline(runs)
+    print("{:<16} {:>9} {:>9} {:>9}".format("command", "min ms", "median ms",
+                                           "over ms"))
+    print("{:<16} {:>9} {:>9.1f} {:>9}".format("(interpreter)", "",
+                                               floor * 1000, ""))
+    failed = False
+    for name, code in COMMANDS.items():
+        times = measure(code, runs)
+        median = statistics.median(times)
+        print("{:<16} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            name, min(times) * 1000, median * 1000, (median - floor) * 1000))
+        failed = failed or median > TARGET
+    print("target: {:.0f} ms -> {}".format(TARGET * 1000,
+                                          "FAIL" if failed else "ok"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+'''
+    Worker agent check: three agents on localhost run a multiplexed job,
+    one of them is stopped midway, and its jobs are restarted on the
+    others. Also checks that agents refuse wrong tokens, that a token
+    is required to listen on a non-loopback address, and that an agent
+    that does not answer does not hold back changes of the inventory.
+    Agents run stand-in jobs, so no real scan is needed.
+
+    Usage: python checks/agents.py
+'''
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer.agent import Agent
+from archer.controller import Controller
+
+
+TOKEN = "check-token"
+CONTEXTS = 12 # number of contexts of the multiplexed job
+TICKS = 40 # updates a stand-in job takes to finish
+
+
+class TickJob:
+    '''
+        Job stand-in: prints a line per update, reports its host once
+        and finishes after TICKS updates.
+    '''
+
+    def __init__(self, name, context):
+        self.context = context
+        self.state = "init"
+        self.return_code = None
+        self._ticks = 0
+        self._output = ""
+
+    def run(self):
+        self.state = "running"
+
+    def update(self):
+        self._ticks += 1
+        self._output += "tick {}\n".format(self._ticks)
+        if self._ticks >= TICKS:
+            self._output += "done\n"
+            self.state, self.return_code = "finished", 0
+        if self._ticks > 1:
+            return []
+        return [{"type": "host", "interface": self.context["interface"].name,
+                 "ip": self.context["host"].ip, "attrs": {"state": "up"}}]
+
+    def read(self):
+        data, self._output = self._output, ""
+        return data
+
+    def write(self, data): pass
+    def signal(self, sig="term"): self.state = "killed"
+    def isRunning(self): return self.state == "running"
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    results = []
+    try:
+        Agent(("0.0.0.0", 0))
+        results.append(check("token required off loopback", False))
+    except Agent.TokenError:
+        results.append(check("token required off loopback", True))
+
+    agents = [Agent(capacity=2, factory=TickJob, token=TOKEN) for _ in range(3)]
+    threads = [threading.Thread(target=agent.serve, kwargs={"period": 0.01})
+               for agent in agents]
+    for thread in threads:
+        thread.start()
+    addresses = ["{}:{}".format(*agent.address) for agent in agents]
+
+    try:
+        c = Controller()
+        try:
+            c.addAgent(addresses[0], token="wrong")
+            results.append(check("wrong token refused", False))
+        except Controller.Error:
+            results.append(check("wrong token refused", True))
+        for address in addresses:
+            c.addAgent(address, token=TOKEN)
+        results.append(check("three agents connected", len(c.agents()) == 3))
+        iface = c.list()[0]
+
+        # Agent that accepts connection but never greets
+        with socket.socket() as silent:
+            silent.bind(("127.0.0.1", 0))
+            silent.listen()
+            errors = []
+            def connect():
+                try:
+                    c.addAgent("127.0.0.1:{}".format(silent.getsockname()[1]))
+                except Controller.Error as exc:
+                    errors.append(exc)
+            connecting = threading.Thread(target=connect)
+            connecting.start()
+            time.sleep(0.2)
+            start = time.time()
+            c.create("/" + iface, "10.77.1.1")
+            elapsed = time.time() - start
+            connecting.join()
+        results.append(check("silent agent does not block writers",
+                             elapsed < 1 and errors and len(c.agents()) == 3))
+
+        paths = ["/{}/10.77.0.{}".format(iface, i) for i in range(1, CONTEXTS + 1)]
+        for path in paths:
+            c.create("/" + iface, path.rsplit("/", 1)[1])
+        jid = c.runMux("tick", paths)
+        running = {agent["address"]: agent["running"] for agent in c.agents()}
+        results.append(check("jobs spread across agents", all(running.values())))
+
+        # Let the jobs make progress, then lose the first agent
+        lines = []
+        for _ in range(10):
+            c.update()
+            lines += c.read(jid).splitlines()
+            time.sleep(0.01)
+        agents[0].stop()
+
+        deadline = time.time() + 30
+        while c.info(jid)["state"] == "running" and time.time() < deadline:
+            c.update()
+            lines += c.read(jid).splitlines()
+            time.sleep(0.01)
+        for _ in range(100):
+            c.update()
+            text = c.read(jid)
+            if not text:
+                break
+            lines += text.splitlines()
+
+        info = c.info(jid)
+        done = {line.split("\t")[1] for line in lines if line.endswith("\tdone")}
+        restarted = {line.split("\t")[1] for line in lines if "restarting job" in line}
+        results += [
+            check("mux job finished successfully",
+                  info["state"] == "finished" and info["return_code"] == 0),
+            check("every context completed", done == set(paths)),
+            check("restarts are marked in output", len(restarted) > 0),
+            check("lost agent dropped", len(c.agents()) == 2),
+            check("hosts reported through agents",
+                  all(c.stat(path)["state"] == "up" for path in paths)),
+        ]
+    finally:
+        for agent in agents:
+            agent.stop()
+        for thread in threads:
+            thread.join()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
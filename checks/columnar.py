@@ -0,0 +1,133 @@
+'''
+    Columnar export/import check: an inventory is exported and imported
+    back in every format whose library is installed, and malformed files
+    are reported, including files that are imported only in part.
+
+    Usage: python checks/columnar.py [hosts]
+'''
+
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer import columnar, util
+from archer.controller import Controller
+from archer.core.host import Host
+from archer.core.port import Port
+
+
+# Formats and the libraries they require
+FORMATS = {"csv": None, "jsonl": None, "npy": "numpy",
+           "parquet": "pyarrow", "arrow": "pyarrow"}
+
+HEADER = ",".join(columnar._names)
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def installed(module):
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return False
+    return True
+
+
+def build(c, iface, count):
+    '''
+        Fill interface with count random hosts and their ports.
+    '''
+    rng = random.Random(3)
+    hosts = []
+    for addr in rng.sample(range(0x0a000000, 0x0b000000), count):
+        host = Host(util.int_to_ip(addr))
+        host.os = rng.choice(["linux", "bsd", None, "x" * 100])
+        host.mac = rng.choice(["00:11:22:33:44:55", None])
+        host.state = rng.choice(["up", "down", "stale"])
+        host.last_activity = rng.choice([None, time.time() - rng.uniform(0, 86400)])
+        for number in rng.sample([22, 53, 80, 443], rng.randint(0, 4)):
+            port = Port(number, rng.choice(["tcp", "udp"]))
+            port.state = rng.choice(["open", "closed", "open|filtered"])
+            port.last_activity = time.time()
+            host.ports[port.proto][port.number] = port
+        hosts.append(host)
+    c._localhost.load(c._localhost.interfaces[iface], hosts)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    c = Controller()
+    iface = c.list()[0]
+    build(c, iface, count)
+    expected = sorted(map(repr, c.listat("/" + iface)))
+    expected_ports = sorted(repr(port) for host in c.listat("/" + iface)
+                            for port in c.listat("/{}/{}".format(iface, host["ip"])))
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, module in FORMATS.items():
+            if module and not installed(module):
+                print("{:<48} skipped ({} not installed)".format(fmt + " round trip", module))
+                continue
+            path = os.path.join(tmp, "inventory." + fmt)
+            rows = c.export(path)
+            fresh = Controller()
+            counts = fresh.import_(path)
+            hosts = fresh.listat("/" + iface)
+            ports = sorted(repr(port) for host in hosts
+                           for port in fresh.listat("/{}/{}".format(iface, host["ip"])))
+            results.append(check(fmt + " round trip",
+                                 counts["hosts"] + counts["ports"] == rows
+                                 and sorted(map(repr, hosts)) == expected
+                                 and ports == expected_ports))
+
+        # Malformed rows are reported, nothing of their chunk is imported
+        bad = {
+            "port number 0": "1,{},167772161,,,1,0,4,",
+            "ip beyond 32 bits": "0,{},4294967297,,,0,0,1,",
+            "negative state": "0,{},167772161,,,0,0,-1,",
+            "negative proto": "1,{},167772161,,,-1,22,4,",
+            "port with no proto": "1,{},167772161,,,0,22,4,",
+            "unknown kind": "2,{},167772161,,,0,0,1,",
+        }
+        for what, row in bad.items():
+            path = os.path.join(tmp, "bad.csv")
+            with open(path, "w") as f:
+                f.write(HEADER + "\n0,{},167772162,,,0,0,1,\n".format(iface)
+                        + row.format(iface) + "\n")
+            fresh = Controller()
+            try:
+                fresh.import_(path)
+                ok = False
+            except Controller.Error:
+                ok = fresh.list("/" + iface) == []
+            results.append(check("rejected: " + what, ok))
+
+        # Malformed chunk after good ones: the good ones stay and are counted
+        path = os.path.join(tmp, "partial.csv")
+        with open(path, "w") as f:
+            f.write(HEADER + "\n")
+            for i in range(1, 11):
+                f.write("0,{},{},,,0,0,1,\n".format(iface, 167772160 + i))
+            f.write("0,{},x,,,0,0,1,\n".format(iface))
+        fresh = Controller()
+        try:
+            columnar.import_(fresh._localhost, path, "csv", chunk=4)
+            ok = False
+        except columnar.PartialError as exc:
+            ok = exc.counts["hosts"] == 8 and len(fresh.list("/" + iface)) == 8
+        results.append(check("partial import reported", ok))
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+'''
+    Concurrency check: writer threads create and delete the same hosts
+    and ports through Controller while a job feeds updates and reader
+    threads run find, listat and stat. Only Controller.Error may reach
+    the callers, and the inventory and its indexes have to stay
+    consistent afterwards.
+
+    Usage: python checks/concurrency.py [seconds]
+'''
+
+import collections
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer.controller import Controller
+
+
+IPS = ["10.1.0.{}".format(i) for i in range(1, 17)] # contended host addresses
+
+
+class FeedJob:
+    '''
+        Job stand-in that reports random ports of the contended hosts.
+    '''
+
+    def __init__(self, iface):
+        self.name = "feed"
+        self.context = {"interface": None, "host": None, "port": None}
+        self.id = None
+        self.state = "running"
+        self.return_code = None
+        self._iface = iface
+        self._rng = random.Random(2)
+
+    def run(self): pass
+    def update(self):
+        return [{"type": "port", "interface": self._iface, "ip": self._rng.choice(IPS),
+                 "proto": "tcp", "number": self._rng.choice([22, 80]),
+                 "attrs": {"state": self._rng.choice(["open", "closed"])}}
+                for _ in range(20)]
+    def read(self): return ""
+    def write(self, data): pass
+    def signal(self, sig="term"): pass
+    def isRunning(self): return True
+    def memoryUsage(self): return 0
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    c = Controller()
+    iface = c.list()[0]
+    c._localhost.addJob(FeedJob(iface))
+
+    unexpected = collections.Counter()
+    samples = []
+    stop = time.time() + seconds
+
+    def worker(action, seed):
+        rng = random.Random(seed)
+        while time.time() < stop:
+            try:
+                action(rng)
+            except Controller.Error:
+                pass
+            except Exception as exc:
+                unexpected[type(exc).__name__] += 1
+                if len(samples) < 3:
+                    samples.append(traceback.format_exc())
+
+    def createHost(rng):
+        c.create("/" + iface, rng.choice(IPS))
+
+    def createPort(rng):
+        c.create("/{}/{}/{}".format(iface, rng.choice(IPS), rng.choice(["tcp", "udp"])),
+                 str(rng.choice([22, 53, 80])))
+
+    def deleteHost(rng):
+        c.delete("/{}/{}".format(iface, rng.choice(IPS)))
+
+    def deletePort(rng):
+        c.delete("/{}/{}/tcp/{}".format(iface, rng.choice(IPS), rng.choice([22, 80])))
+
+    def update(rng):
+        c.update()
+
+    def find(rng):
+        list(c.find(rng.choice(["ports where port=tcp/22", "ports where ip in 10.1.0.0/16",
+                                "hosts where tcp/80=open", "hosts where seen<1h"])))
+
+    def read(rng):
+        c.listat("/" + iface)
+        c.stat("/{}/{}".format(iface, rng.choice(IPS)))
+
+    actions = [createHost, createPort, createPort, deleteHost, deletePort,
+               update, find, find, read]
+    threads = [threading.Thread(target=worker, args=(action, seed))
+               for seed, action in enumerate(actions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = [check("no unexpected exceptions", not unexpected)]
+    for name, count in unexpected.items():
+        print("    {} x{}".format(name, count))
+    for sample in samples:
+        print(sample)
+
+    # Every indexed object is in the inventory and vice versa
+    lh = c._localhost
+    index = lh._index
+    hosts = set(lh.interfaces[iface].hosts.values())
+    ports = {port for host in hosts for port in host.allPorts()}
+    results += [
+        check("indexed hosts match inventory", index.objects["host"] == hosts),
+        check("indexed ports match inventory", index.objects["port"] == ports),
+        check("parents of ports are their hosts",
+              all(index.parents[port].ports[port.proto].get(port.number) is port
+                  for port in ports)),
+        check("no orphans in parents index", set(index.parents) == hosts | ports),
+    ]
+    try:
+        found = len(list(c.find("ports where port=tcp/22")))
+        results.append(check("find after the run", found == sum(
+            1 for port in ports if port.proto == "tcp" and port.number == 22)))
+    except Exception:
+        traceback.print_exc()
+        results.append(check("find after the run", False))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
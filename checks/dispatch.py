@@ -0,0 +1,116 @@
+'''
+    Subscription check: prefix and network matching, coalescing backlog
+    of full queues, isolation of failing, slow and self-cancelling
+    subscribers, and rejection of malformed paths.
+
+    Usage: python checks/dispatch.py
+'''
+
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer.controller import Controller
+from archer.dispatch import Dispatcher
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def wait(predicate, timeout=5.0):
+    '''
+        Wait until predicate() is true. Return its last value.
+    '''
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def event(device, evtype="state"):
+    return {"type": evtype, "device": device}
+
+
+def main():
+    results = []
+
+    # Matching by prefix, network and type
+    d = Dispatcher()
+    got = {name: [] for name in ("all", "iface", "net", "port", "added")}
+    d.subscribe("/", None, got["all"].append)
+    d.subscribe("/eth0", None, got["iface"].append)
+    d.subscribe("/eth0/10.1.0.0/16", None, got["net"].append)
+    d.subscribe("/eth0/10.1.2.3/tcp/22", None, got["port"].append)
+    d.subscribe("/eth0", "added", got["added"].append)
+    for device in ("/eth0/10.1.2.3/tcp/22", "/eth0/10.1.9.9", "/eth0/10.2.0.1", "/eth1/10.1.2.3"):
+        d.dispatch(event(device))
+    d.dispatch(event("/eth0/10.1.2.3", "added"))
+    wait(lambda: len(got["all"]) == 5 and len(got["added"]) == 1)
+    results += [
+        check("root prefix gets everything", len(got["all"]) == 5),
+        check("interface prefix", len(got["iface"]) == 4),
+        check("network prefix", [ev["device"] for ev in got["net"]] ==
+              ["/eth0/10.1.2.3/tcp/22", "/eth0/10.1.9.9", "/eth0/10.1.2.3"]),
+        check("port prefix", len(got["port"]) == 1),
+        check("type filter", [ev["type"] for ev in got["added"]] == ["added"]),
+    ]
+
+    # Full queue: events are coalesced per device and type, then dropped
+    d = Dispatcher()
+    q = queue.Queue(maxsize=1)
+    sub = d.subscribe("/", None, q, backlog=2)
+    for device in ("/eth0/10.0.0.1", "/eth0/10.0.0.2", "/eth0/10.0.0.2",
+                   "/eth0/10.0.0.3", "/eth0/10.0.0.4"):
+        d.dispatch(event(device))
+    results += [
+        check("queue backlog coalesced", sub.coalesced == 1),
+        check("queue backlog bounded", len(sub.backlog) == 2 and sub.dropped == 1),
+    ]
+    q.get_nowait()
+    d.flush()
+    results.append(check("backlog flushed in order",
+                         q.get_nowait()["device"] == "/eth0/10.0.0.3"))
+
+    # Failing, slow and self-cancelling subscribers do not affect others
+    d = Dispatcher()
+    healthy, release = [], threading.Event()
+    failing = d.subscribe("/", None, lambda ev: 1 / 0)
+    slow = d.subscribe("/", None, lambda ev: release.wait(), backlog=10)
+    selfish = d.subscribe("/", None, lambda ev: d.unsubscribe(selfish.id))
+    d.subscribe("/", None, healthy.append)
+    start = time.time()
+    for i in range(100):
+        d.dispatch(event("/eth0/10.0.{}.1".format(i)))
+    elapsed = time.time() - start
+    wait(lambda: len(healthy) == 100 and failing.errors == 100)
+    results += [
+        check("slow callable does not block dispatch", elapsed < 1.0),
+        check("slow callable backlog bounded", len(slow.backlog) <= 10),
+        check("failing callable errors counted", failing.errors == 100),
+        check("self-unsubscribe keeps others served", len(healthy) == 100),
+        check("self-unsubscribe cancels subscription", not selfish.active),
+    ]
+    release.set()
+
+    # Malformed paths are reported as errors
+    c = Controller()
+    bad = ["/eth0/10.0.0.1/²", "/eth0/10.0.0.0/40", "/eth0/host", "/eth0/10.0.0.1/icmp",
+           "/eth0/10.0.0.1/tcp/x", "/eth0/10.0.0.1/tcp/22/x"]
+    rejected = 0
+    for path in bad:
+        try:
+            c.subscribe(path, None, print)
+        except Controller.Error:
+            rejected += 1
+    results.append(check("malformed paths rejected", rejected == len(bad)))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+    Expiry check: a host and a port that go quiet are marked stale,
+    and fresh activity afterwards brings back their state. TTL changes
+    apply to objects that are already quiet.
+    Job messages are fed by a stand-in job, so no real scan is needed.
+
+    Usage: python checks/expiry.py
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer.controller import Controller
+
+
+class FeedJob:
+    '''
+        Job stand-in that hands out messages queued by feed().
+    '''
+
+    def __init__(self):
+        self.name = "feed"
+        self.context = {"interface": None, "host": None, "port": None}
+        self.id = None
+        self.state = "running"
+        self.return_code = None
+        self._messages = []
+
+    def feed(self, message):
+        self._messages.append(message)
+
+    def run(self): pass
+    def update(self):
+        messages, self._messages = self._messages, []
+        return messages
+    def read(self): return ""
+    def write(self, data): pass
+    def signal(self, sig="term"): pass
+    def isRunning(self): return True
+    def memoryUsage(self): return 0
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    c = Controller()
+    iface = c.list()[0]
+    job = FeedJob()
+    c._localhost.addJob(job)
+    message = {"type": "port", "interface": iface, "ip": "10.9.8.7",
+               "proto": "tcp", "number": 22, "attrs": {"state": "open"}}
+    host, port = "/{}/10.9.8.7".format(iface), "/{}/10.9.8.7/tcp/22".format(iface)
+
+    # Two hours old observation outlives the default TTL of one hour
+    job.feed(dict(message, time=time.time() - 7200))
+    c.update()
+    c.update()
+    results = [
+        check("port expired", c.stat(port)["state"] == "stale"),
+        check("host expired", c.stat(host)["state"] == "stale"),
+        check("query sees expired host", host in c.find("hosts where state=stale")),
+    ]
+
+    # Fresh observation without state restores the states before expiry
+    job.feed(dict(message, attrs={}, time=time.time()))
+    events = c.update()
+    results += [
+        check("port state restored", c.stat(port)["state"] == "open"),
+        check("host state restored", c.stat(host)["state"] == "unknown"),
+        check("state events emitted",
+              {ev["device"] for ev in events if ev["type"] == "state"} == {host, port}),
+        check("query no longer sees host", host not in c.find("hosts where state=stale")),
+        check("last activity is current", time.time() - c.stat(host)["last_activity"] < 60),
+    ]
+
+    # Objects added while expiry is disabled expire once TTL is set
+    c = Controller()
+    c.setTtl(None)
+    c.create("/" + iface, "10.9.8.6")
+    path = "/{}/10.9.8.6".format(iface)
+    lh = c._localhost
+    lh.setAttrs(lh.interfaces[iface].hosts["10.9.8.6"], last_activity=time.time() - 100)
+    c.update()
+    results.append(check("no expiry while TTL is disabled", c.stat(path)["state"] == "unknown"))
+    c.setTtl(10)
+    c.update()
+    results.append(check("expiry after TTL is enabled", c.stat(path)["state"] == "stale"))
+
+    # Lowered TTL applies to objects that are already scheduled
+    c = Controller()
+    c.create("/" + iface, "10.9.8.5")
+    path = "/{}/10.9.8.5".format(iface)
+    lh = c._localhost
+    lh.setAttrs(lh.interfaces[iface].hosts["10.9.8.5"], last_activity=time.time() - 100)
+    c.update()
+    results.append(check("no expiry within default TTL", c.stat(path)["state"] == "unknown"))
+    c.setTtl(50, iface, "host")
+    c.update()
+    results.append(check("expiry after TTL is lowered", c.stat(path)["state"] == "stale"))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+'''
+    Multiplexed job check: output of the jobs is merged round-robin
+    within per-read quota, lines and events are tagged with context
+    paths and growing sequence numbers, events of Controller.update
+    carry the tags, backpressure pauses jobs once output is being read
+    but not before, and drain() takes all the output in order.
+    Stand-in jobs are used, so no real scan is needed.
+
+    Usage: python checks/mux.py
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer import core
+from archer.controller import Controller
+
+
+class LineJob:
+    '''
+        Job stand-in that prints given number of lines and reports
+        its host once per update, and finishes after ticks updates.
+    '''
+
+    def __init__(self, context, lines, ticks):
+        self.context = context
+        self.state = "running"
+        self.return_code = None
+        self.ticks = 0
+        self._lines = lines
+        self._limit = ticks
+        self._output = ""
+
+    def run(self): pass
+    def update(self):
+        self.ticks += 1
+        self._output += "".join("tick {} line {}\n".format(self.ticks, i)
+                                for i in range(self._lines))
+        if self.ticks >= self._limit:
+            self.state, self.return_code = "finished", 0
+        return [{"type": "host", "interface": self.context["interface"].name,
+                 "ip": self.context["host"].ip, "attrs": {"state": "up"}}]
+    def read(self):
+        data, self._output = self._output, ""
+        return data
+    def write(self, data): pass
+    def signal(self, sig="term"): self.state = "killed"
+    def isRunning(self): return self.state == "running"
+    def memoryUsage(self): return len(self._output)
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def parse(text):
+    '''
+        Split tagged output into (seq, path, line) tuples.
+    '''
+    return [(int(seq), path, line) for seq, path, line in
+            (row.split("\t", 2) for row in text.splitlines())]
+
+
+def mux(c, paths, lines, ticks, **limits):
+    '''
+        Add MuxJob of LineJob stand-ins run in given paths. Return it.
+    '''
+    contexts = [c._parsePath(path) for path in paths]
+    job = core.MuxJob("lines", contexts, **limits)
+    job.jobs = [LineJob(context, lines, ticks) for context in contexts]
+    c._localhost.addJob(job)
+    return job
+
+
+def main():
+    c = Controller()
+    iface = c.list()[0]
+    paths = ["/{}/10.3.0.{}".format(iface, i) for i in range(1, 4)]
+    for path in paths:
+        c.create("/" + iface, path.rsplit("/", 1)[1])
+    results = []
+
+    # Fair merging within quota, sequence numbers and tags
+    job = mux(c, paths, lines=200, ticks=1, quota=1000)
+    events = c.update()
+    rows = parse(c.read(job.id))
+    taken = {path: sum(len(line) + 1 for _, p, line in rows if p == path) for path in paths}
+    results += [
+        check("events interleaved between jobs",
+              [ev["source"] for ev in events] == paths
+              and [ev["device"] for ev in events] == paths),
+        check("events carry growing seq",
+              [ev["seq"] for ev in events] == sorted(ev["seq"] for ev in events)),
+        check("every job served within quota",
+              all(0 < size <= 1000 for size in taken.values())),
+        check("lines of a job keep their order",
+              all([seq for seq, p, _ in rows if p == path]
+                  == sorted(seq for seq, p, _ in rows if p == path) for path in paths)),
+    ]
+    rest = []
+    while True:
+        text = c.read(job.id)
+        if not text:
+            break
+        rest += parse(text)
+    results.append(check("all output read in the end",
+                         len(rows) + len(rest) == 3 * 200
+                         and rest[-1][2] == "tick 1 line 199"))
+
+    # Backpressure pauses jobs once output is being read
+    job = mux(c, paths, lines=100, ticks=1000, backlog=5000)
+    c.update()
+    c.read(job.id)
+    for _ in range(20):
+        c.update()
+    results.append(check("unread jobs paused",
+                         all(child.ticks < 10 for child in job.jobs)))
+    for _ in range(20):
+        c.read(job.id)
+        c.update()
+    results.append(check("reading resumes paused jobs",
+                         all(child.ticks >= 10 for child in job.jobs)))
+
+    # Consumers that never read do not stall the job
+    job = mux(c, paths, lines=100, ticks=30, backlog=5000)
+    for _ in range(40):
+        c.update()
+    results.append(check("job not read finishes", c.info(job.id)["state"] == "finished"))
+
+    # Backlog of None disables backpressure through runMux
+    jid = c.runMux("lines", paths, backlog=None, quota=100)
+    results.append(check("runMux passes limits",
+                         c._localhost.jobs[jid].backlog is None
+                         and c._localhost.jobs[jid].quota == 100))
+    refused = 0
+    for limits in ({"backlog": 0}, {"quota": None}, {"quota": -1}):
+        try:
+            c.runMux("lines", paths, **limits)
+        except Controller.Error:
+            refused += 1
+    results.append(check("invalid limits refused", refused == 3))
+
+    # Drain takes all the output in arrival order
+    job = mux(c, paths, lines=50, ticks=2)
+    c.update()
+    c.update()
+    rows = parse(job.drain())
+    results += [
+        check("drain takes all the output", len(rows) == 3 * 2 * 50),
+        check("drain keeps arrival order", [seq for seq, _, _ in rows]
+              == sorted(seq for seq, _, _ in rows)),
+        check("nothing left after drain", job.read() == "" and job.memoryUsage() == 0),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+'''
+    Query check: results of inventory queries and CIDR lookups of the
+    index are compared with a brute-force scan of a random inventory,
+    also after a part of it is deleted and changed.
+
+    Usage: python checks/query.py [hosts]
+'''
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer import util
+from archer.controller import Controller
+from archer.core.host import Host
+from archer.core.port import Port
+
+
+NOW = time.time()
+
+# Queries and brute-force predicates over (host, port) pairs;
+# port is None for host queries
+QUERIES = [
+    ("hosts where tcp/22=open and os=linux",
+     lambda h, p: h.os == "linux" and _port(h, "tcp", 22, "open")),
+    ("hosts where tcp/22!=open",
+     lambda h, p: not _port(h, "tcp", 22, "open")),
+    ("hosts where os=bsd and seen<1h",
+     lambda h, p: h.os == "bsd" and NOW - h.last_activity < 3600),
+    ("hosts where ip in 10.1.0.0/16",
+     lambda h, p: h.ip.startswith("10.1.")),
+    ("hosts where ip=10.0.0.0/8 and state=up",
+     lambda h, p: h.state == "up"),
+    ("hosts where seen>=2h",
+     lambda h, p: NOW - h.last_activity >= 7200),
+    ("ports where state=filtered and seen<2h",
+     lambda h, p: p.state == "filtered" and NOW - p.last_activity < 7200),
+    ("ports where port=tcp/22 and ip in 10.2.0.0/15",
+     lambda h, p: p.proto == "tcp" and p.number == 22
+     and h.ip.split(".")[1] in ("2", "3")),
+    ("ports where number=53 and os=linux",
+     lambda h, p: p.number == 53 and h.os == "linux"),
+    ("ports where proto=udp and state!=open",
+     lambda h, p: p.proto == "udp" and p.state != "open"),
+]
+
+
+def _port(host, proto, number, state):
+    port = host.ports[proto].get(number)
+    return port is not None and port.state == state
+
+
+def check(what, ok):
+    print("{:<56} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def build(c, iface, count, rng):
+    '''
+        Fill interface with count random hosts and their ports.
+    '''
+    lh = c._localhost
+    hosts = []
+    for addr in rng.sample(range(0x0a000000, 0x0a040000), count):
+        host = Host(util.int_to_ip(addr))
+        host.os = rng.choice(["linux", "bsd", None])
+        host.state = rng.choice(["up", "down", "unknown"])
+        host.last_activity = NOW - rng.uniform(0, 3 * 3600)
+        for proto, number in rng.sample([("tcp", 22), ("tcp", 80), ("udp", 53)],
+                                        rng.randint(0, 3)):
+            port = Port(number, proto)
+            port.state = rng.choice(["open", "closed", "filtered"])
+            port.last_activity = NOW - rng.uniform(0, 3 * 3600)
+            host.ports[proto][number] = port
+        hosts.append(host)
+    lh.load(lh.interfaces[iface], hosts)
+
+
+def compare(c, iface, tag):
+    '''
+        Compare every query with brute-force scan. Return list of results.
+    '''
+    hosts = list(c._localhost.interfaces[iface].hosts.values())
+    results = []
+    for expr, predicate in QUERIES:
+        if expr.startswith("hosts"):
+            expected = {"/{}/{}".format(iface, h.ip) for h in hosts if predicate(h, None)}
+        else:
+            expected = {"/{}/{}/{}/{}".format(iface, h.ip, p.proto, p.number)
+                        for h in hosts for p in h.allPorts() if predicate(h, p)}
+        found = list(c.find(expr))
+        results.append(check("{}: {}".format(tag, expr),
+                             set(found) == expected and len(found) == len(expected)))
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(1)
+    c = Controller()
+    iface = c.list()[0]
+    build(c, iface, count, rng)
+    results = compare(c, iface, "fresh")
+
+    # Delete a third of the hosts and change some others
+    lh = c._localhost
+    hosts = list(lh.interfaces[iface].hosts.values())
+    for host in hosts[:count // 3]:
+        c.delete("/{}/{}".format(iface, host.ip))
+    for host in hosts[count // 3:count // 2]:
+        lh.setAttrs(host, os="linux", state="up", last_activity=NOW)
+        for port in host.allPorts():
+            lh.setAttrs(port, state="filtered", last_activity=NOW - 60)
+    results += compare(c, iface, "changed")
+
+    # CIDR lookups of the index against a scan of all the addresses
+    index = lh._index
+    addrs = [util.ip_to_int(h.ip) for h in lh.interfaces[iface].hosts.values()]
+    ok = True
+    for _ in range(200):
+        length = rng.randint(0, 32)
+        network = rng.choice(addrs) if rng.random() < 0.8 else rng.getrandbits(32)
+        mask = (0xffffffff << (32 - length)) & 0xffffffff
+        expected = sorted(a for a in addrs if a & mask == network & mask)
+        found = sorted(util.ip_to_int(h.ip) for h in index.hostsInNetwork(network, length))
+        ok = ok and found == expected and index.countInNetwork(network, length) == len(expected)
+    results.append(check("index CIDR lookups match scan", ok))
+
+    # Malformed queries are reported as errors
+    rejected = 0
+    bad = ["nodes where os=linux", "hosts where foo=1", "hosts where tcp/22<open",
+           "hosts where seen<abc", "ports where port>tcp/22", "hosts where ip in 10.0.0.0/40"]
+    for expr in bad:
+        try:
+            list(c.find(expr))
+        except Controller.Error:
+            rejected += 1
+    results.append(check("malformed queries rejected", rejected == len(bad)))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
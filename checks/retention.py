@@ -0,0 +1,149 @@
+'''
+    Retention check: finished jobs are compacted into summaries by
+    number and by bytes of output, summaries and old jobs are evicted,
+    memory accounting adds up, summaries do not hold network objects,
+    and a summary of a multiplexed job keeps the end of its output.
+    Stand-in jobs are used, so no real scan is needed.
+
+    Usage: python checks/retention.py
+'''
+
+import gc
+import os
+import sys
+import time
+import weakref
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archer import core
+from archer.controller import Controller
+
+
+class DoneJob:
+    '''
+        Job stand-in that finishes at once with given output.
+    '''
+
+    def __init__(self, output="", context=None):
+        self.name = "done"
+        self.context = context or {"interface": None, "host": None, "port": None}
+        self.id = None
+        self.state = "running"
+        self.return_code = None
+        self._output = output
+
+    def run(self): pass
+    def update(self):
+        self.state, self.return_code = "finished", 0
+        return []
+    def read(self):
+        data, self._output = self._output, ""
+        return data
+    def write(self, data): pass
+    def signal(self, sig="term"): pass
+    def isRunning(self): return self.state == "running"
+    def memoryUsage(self): return len(self._output)
+
+
+def check(what, ok):
+    print("{:<48} {}".format(what, "ok" if ok else "FAIL"))
+    return ok
+
+
+def run(c, jobs):
+    '''
+        Add jobs and let them finish. Return their ids.
+    '''
+    for job in jobs:
+        c._localhost.addJob(job)
+    c.update()
+    return [job.id for job in jobs]
+
+
+def main():
+    results = []
+
+    # Compaction by number of finished jobs
+    c = Controller()
+    c.setRetention(max_jobs=3)
+    jids = run(c, [DoneJob("line {}\n".format(i)) for i in range(10)])
+    usage = c.memory()
+    results += [
+        check("compacted beyond max_jobs",
+              usage["finished"] == 3 and usage["summaries"] == 7),
+        check("oldest jobs compacted first",
+              all(c.memory(jid)["compacted"] for jid in jids[:7])
+              and not any(c.memory(jid)["compacted"] for jid in jids[7:])),
+        check("summary keeps unread output", c.read(jids[0]) == "line 0\n"),
+        check("memory totals add up",
+              usage["total"] == sum(usage["jobs"].values())
+              and usage["jobs"][jids[1]] == core.JobSummary.OVERHEAD + len("line 1\n")),
+    ]
+
+    # Compaction by bytes of output, tail is cut
+    c = Controller()
+    c.setRetention(max_jobs=None, max_bytes=10000, tail=100)
+    jids = run(c, [DoneJob("x" * 4000) for _ in range(5)])
+    usage = c.memory()
+    results += [
+        check("compacted beyond max_bytes",
+              usage["finished"] == 2 and usage["summaries"] == 3),
+        check("summary tail is cut", c.read(jids[0]) == "x" * 100
+              and c.info(jids[0])["compacted"]),
+    ]
+
+    # Eviction of the oldest summaries and of old jobs
+    c = Controller()
+    c.setRetention(max_jobs=0, max_summaries=4)
+    jids = run(c, [DoneJob() for _ in range(6)])
+    c.update()
+    results.append(check("summaries evicted beyond max_summaries",
+                         sorted(c._localhost.jobs) == jids[2:]))
+    c.setRetention(max_jobs=None, max_age=0.05)
+    run(c, [DoneJob()])
+    time.sleep(0.1)
+    c.update()
+    results.append(check("old jobs and summaries evicted",
+                         not c._localhost.jobs and not c._localhost.governor.stats))
+
+    # Summary does not keep deleted host alive
+    c = Controller()
+    iface = c.list()[0]
+    c.create("/" + iface, "10.5.5.5")
+    lh = c._localhost
+    host = lh.interfaces[iface].hosts["10.5.5.5"]
+    ref = weakref.ref(host)
+    job = DoneJob("out\n", {"interface": lh.interfaces[iface], "host": host, "port": None})
+    c.setRetention(max_jobs=0)
+    jid, = run(c, [job])
+    summary = lh.jobs[jid]
+    del host, job
+    c.delete("/{}/10.5.5.5".format(iface))
+    gc.collect()
+    results += [
+        check("summary keeps context path",
+              summary.path == "/{}/10.5.5.5".format(iface)),
+        check("deleted host not held by summary", ref() is None),
+    ]
+
+    # Summary of multiplexed job keeps the end of output beyond quota
+    c = Controller()
+    c.setRetention(max_jobs=0, tail=1024)
+    mux = core.MuxJob("done", [{}, {}])
+    mux.jobs = [DoneJob("".join("{} line {}\n".format(n, i) for i in range(8000)))
+                for n in ("a", "b")]
+    jid, = run(c, [mux])
+    tail = c.read(jid)
+    results += [
+        check("mux output drained into summary",
+              sum(job.memoryUsage() for job in mux.jobs) == 0
+              and c.info(jid)["compacted"]),
+        check("mux summary tail ends at last line",
+              tail.endswith("b line 7999\n") and len(tail) == 1024),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()